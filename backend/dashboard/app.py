@@ -14,8 +14,11 @@ dashboard/app.py  ― フェーズ1 ホワイトボックス化（タブ型 SaaS
 
 import os
 import sqlite3
+import string
 from datetime import date, datetime, timezone, timedelta
+from operator import itemgetter
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
@@ -25,22 +28,35 @@ DB_PATH = os.path.join(os.path.dirname(__file__), "..", "inventory.db")
 
 import sys as _sys
 import importlib
-_sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# rerun のたびに無条件 insert すると sys.path が際限なく伸びるため、
+# 未登録のときだけ backend ディレクトリを先頭に足す
+_BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+if _BACKEND_DIR not in _sys.path:
+    _sys.path.insert(0, _BACKEND_DIR)
+
+# importlib.reload は rerun のたびにエンジン全体を再パースし、関数オブジェクトを
+# 作り直して st.cache_data 等のキャッシュを無効化してしまう。
+# エンジンを編集しながら開発するときだけ DASH_DEV_RELOAD=1 で有効化する。
+_DEV_RELOAD = os.environ.get("DASH_DEV_RELOAD") == "1"
 
 import packaging_engine
-importlib.reload(packaging_engine)
+if _DEV_RELOAD:
+    importlib.reload(packaging_engine)
 from packaging_engine import (
-    get_velocity_ratio, calc_velocity_adjustment,
+    get_velocity_ratio, get_velocity_ratio_batch, calc_velocity_adjustment,
     hotel_urgency_score, calculate_roi_metrics, calculate_inventory_rescue_metrics,
-    calculate_demand_forecast, calculate_optimal_strategy, simulate_sales_scenario
+    calculate_demand_forecast, calculate_demand_forecast_batch,
+    calculate_optimal_strategy, simulate_sales_scenario
 )
 import pricing_engine
-importlib.reload(pricing_engine)
-from pricing_engine import calculate_inventory_decay_factor
+if _DEV_RELOAD:
+    importlib.reload(pricing_engine)
+from pricing_engine import calculate_inventory_decay_factor, calculate_pricing_result_batch
 
 # 共通ユーティリティのインポート
 from dashboard.utils import (
-    apply_custom_css, dark_layout, render_metric_card, render_alerts, hex_to_rgba, log_price_history
+    apply_custom_css, dark_layout, render_metric_card, render_alerts, log_price_history,
+    compute_alerts, render_alerts_prebuilt
 )
 
 st.set_page_config(
@@ -55,60 +71,294 @@ apply_custom_css()
 
 # ─── データ取得 ───────────────────────────────────────────────────
 
+@st.cache_resource
+def get_ro_conn() -> sqlite3.Connection:
+    """読み取り専用の共有 SQLite 接続。
+
+    各ローダーが毎回 connect/close を繰り返すとページキャッシュが
+    コールドスタートするため、rerun をまたいで 1 本を使い回す。
+    """
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    conn.executescript("""
+        PRAGMA query_only=1;
+        PRAGMA cache_size=-65536;
+        PRAGMA temp_store=memory;
+        PRAGMA mmap_size=268435456;
+    """)
+    return conn
+
+@st.cache_resource
+def get_rw_conn() -> sqlite3.Connection:
+    """書き込み用の共有 SQLite 接続（価格履歴の記録用）"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+    """)
+    return conn
+
+def _read_df(sql: str, params=None) -> pd.DataFrame:
+    """pd.read_sql の薄い代替。
+
+    read_sql はドライバ判定や dtype 推論のオーバーヘッドが大きく、
+    この規模の DB では実 I/O より高くつくため、cursor の fetchall を
+    from_records で直接 DataFrame 化する。
+    """
+    cur = get_ro_conn().execute(sql, params or ())
+    return pd.DataFrame.from_records(cur.fetchall(), columns=[d[0] for d in cur.description])
+
 @st.cache_data(ttl=60)
 def load_inventory() -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql("SELECT * FROM inventory", conn)
-    conn.close()
-    return df
+    return _read_df("SELECT * FROM inventory")
 
 @st.cache_data(ttl=60)
-def load_history() -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql("""
+def load_history(ids: tuple = (), days: int = 90) -> pd.DataFrame:
+    # price_history は rerun のたびに成長するため、pandas 側での isin 絞り込み
+    # ではなく SQL の WHERE 句（(inventory_id, recorded_at) インデックス）で
+    # 絞り込む。days で直近分だけに窓をかけ、全履歴を Python 側へ運ばない
+    # （days=None で全期間）。
+    conditions = []
+    params = []
+    if ids:
+        placeholders = ",".join("?" * len(ids))
+        conditions.append(f"h.inventory_id IN ({placeholders})")
+        params.extend(ids)
+    if days is not None:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        conditions.append("h.recorded_at >= ?")
+        params.append(cutoff)
+    where_clause = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    params = tuple(params) or None
+    df = _read_df(f"""
         SELECT h.inventory_id, i.name, i.total_stock, i.base_price,
                i.departure_date,
                h.recorded_at, h.remaining_stock, h.dynamic_price, h.lead_days
         FROM price_history h
         JOIN inventory i ON h.inventory_id = i.id
+        {where_clause}
         ORDER BY h.recorded_at ASC
-    """, conn)
-    conn.close()
+    """, params)
     if not df.empty:
-        df["recorded_at"] = pd.to_datetime(df["recorded_at"], utc=True)
-        df["recorded_at"] = df["recorded_at"].dt.tz_convert("Asia/Tokyo")
+        # format 指定で pandas の書式推論をスキップし、ndarray を直接渡して
+        # 中間 Series を作らず tz 変換まで 1 式で行う
+        df["recorded_at"] = pd.to_datetime(df["recorded_at"].to_numpy(), utc=True, format="ISO8601").tz_convert("Asia/Tokyo")
     return df
 
 @st.cache_data(ttl=60)
 def load_booking_events() -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql("SELECT * FROM booking_events", conn)
-    conn.close()
+    # ダッシュボードが実際に参照する列だけを運ぶ
+    # （is_package / discount_amount 等は UI では未使用）
+    df = _read_df("SELECT inventory_id, booked_at, quantity, sold_price FROM booking_events")
     if not df.empty:
-        df["booked_at"] = pd.to_datetime(df["booked_at"], utc=True)
-        df["booked_at"] = df["booked_at"].dt.tz_convert("Asia/Tokyo")
+        df["booked_at"] = pd.to_datetime(df["booked_at"].to_numpy(), utc=True, format="ISO8601").tz_convert("Asia/Tokyo")
     return df
 
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _compute_pricing(rows: tuple, config_key: tuple, strategy: str, reference_date: date) -> list[dict]:
+    """凍結済みの行タプルから PricingResult リストを計算する（キャッシュ本体）
+
+    行ごとに calculate_pricing_result を呼ぶのではなく、DataFrame に戻して
+    バッチ版エンジンに渡し、調整額・クランプを列演算で一括計算する。
+    """
+    df = pd.DataFrame(
+        list(rows),
+        columns=["id", "name", "base_price", "total_stock", "remaining_stock", "departure_date", "elasticity"],
+    )
+    results_df = calculate_pricing_result_batch(
+        df, config=dict(config_key), strategy=strategy, reference_date=reference_date
+    )
+    return results_df.to_dict("records")
+
+# ─── 分析エンジンのメモ化ラッパー ─────────────────────────────────
+# DB の鮮度ウィンドウ (ttl=60) 内であれば、同一入力での再計算を避ける。
+# list / dict はハッシュ不能のため tuple に凍結して受け取る。
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def cached_roi_metrics(ids: tuple, start: str = None, end: str = None, ref: date = None) -> dict:
+    return calculate_roi_metrics(
+        inventory_ids=list(ids), target_start_date=start, target_end_date=end, reference_date=ref
+    )
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def cached_rescue_metrics(ids: tuple, ref: date = None) -> dict:
+    return calculate_inventory_rescue_metrics(inventory_ids=list(ids), reference_date=ref)
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def cached_alerts(res_key: tuple, ref: date, _results=None, _inv_df=None, _fn=None) -> list[tuple]:
+    # res_key が実質的なキャッシュキー。アンダースコア引数はハッシュ対象外。
+    return compute_alerts(_results, _inv_df, [], _fn)
+
+@st.cache_data(ttl=60, max_entries=256, show_spinner=False)
+def cached_simulation(h_key: tuple, f_key: tuple, discount: int, lead_days: int,
+                      market_condition: str, ref: date = None) -> dict:
+    """シミュレーション結果をメモ化する（引数はハッシュ可能なタプルのみ）"""
+    return simulate_sales_scenario(
+        dict(h_key), dict(f_key), discount, lead_days, market_condition, reference_date=ref
+    )
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def cached_discount_sweep(h_key: tuple, f_key: tuple, lead_days: int,
+                          market_condition: str, ref: date = None) -> tuple:
+    """割引候補 0〜20,000 円（スライダーと同じ 500 円刻み）を一括評価し、
+    利益差分が最大になる (割引額, 差分) を返す"""
+    h_item, f_item = dict(h_key), dict(f_key)
+    best_disc = 0
+    best_gain = None
+    for disc in range(0, 20001, 500):
+        sim = simulate_sales_scenario(h_item, f_item, disc, lead_days, market_condition, reference_date=ref)
+        if best_gain is None or sim["gain"] > best_gain:
+            best_gain, best_disc = sim["gain"], disc
+    return best_disc, best_gain
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def cached_optimal_strategy(scenario: str, ids: tuple, prices: tuple, ref: date = None) -> dict:
+    return calculate_optimal_strategy(
+        scenario=scenario, inventory_ids=list(ids), current_prices=dict(prices), reference_date=ref
+    )
+
+@st.cache_data(ttl=60, max_entries=16, show_spinner=False)
+def build_roi_figure_dict(daily_rows: tuple) -> dict:
+    """ROI 推移チャートを構築し、キャッシュ可能な dict 形式で返す"""
+    # 行ごとの dict 生成（列アライメントが行数分走る）ではなく、
+    # 列 → 値リストの辞書から一括で構築する
+    keys = [k for k, _ in daily_rows[0]]
+    df_daily = pd.DataFrame({k: [row[i][1] for row in daily_rows] for i, k in enumerate(keys)})
+    df_daily["cum_dyn_sales"] = df_daily.get("day_dyn_sales", 0).cumsum()
+    df_daily["cum_dyn_waste"] = df_daily.get("day_dyn_waste", 0).cumsum()
+    df_daily["cum_fix_sales"] = df_daily.get("day_fix_sales", 0).cumsum()
+    df_daily["cum_fix_waste"] = df_daily.get("day_fix_waste", 0).cumsum()
+
+    fig_roi = go.Figure()
+    # 日次系列が長いときは WebGL 経路に切り替える
+    _roi_scatter = go.Scattergl if len(df_daily) > 500 else go.Scatter
+
+    # 1. 動的価格・売上 (Green, solid/filled)
+    fig_roi.add_trace(_roi_scatter(
+        x=df_daily["day"], y=df_daily["cum_dyn_sales"], name="動的価格・売上 (実績)",
+        mode='lines+markers', line=dict(color='#10b981', width=3),
+        fill='tozeroy', fillcolor='rgba(16,185,129,0.1)'
+    ))
+    # 2. 固定価格・売上 (Blue, dashed)
+    fig_roi.add_trace(_roi_scatter(
+        x=df_daily["day"], y=df_daily["cum_fix_sales"], name="固定価格・売上 (想定)",
+        mode='lines', line=dict(color='#0ea5e9', width=2, dash='dash')
+    ))
+    # 3. 固定価格・廃棄損 (Orange, dashed)
+    fig_roi.add_trace(_roi_scatter(
+        x=df_daily["day"], y=df_daily["cum_fix_waste"], name="固定価格・廃棄損 (想定)",
+        mode='lines', line=dict(color='#fb923c', width=2, dash='dash')
+    ))
+    # 4. 動的価格・廃棄損 (Red, solid) - グラフ上で比較対象として明示
+    fig_roi.add_trace(_roi_scatter(
+        x=df_daily["day"], y=df_daily["cum_dyn_waste"], name="動的価格・廃棄損 (実績)",
+        mode='lines+markers', line=dict(color='#f43f5e', width=3)
+    ))
+
+    dark_layout(fig_roi, "累積売上と廃棄損の推移", yaxis_title="累積金額 (円)")
+    return fig_roi.to_dict()
+
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def build_radar_figure_dict(scores: tuple, labels: tuple) -> dict:
+    """商品カルテの5軸レーダーチャートを構築し dict 形式で返す
+
+    キーはスコア・ラベルのタプルのみ。同一データの rerun では trace 構築
+    ごと丸ごとスキップされ、呼び出し側は go.Figure(dict) で復元するだけ。
+    """
+    scores = list(scores)
+    labels = list(labels)
+    fig_radar = go.Figure(go.Scatterpolar(
+        r=np.asarray(scores + [scores[0]], dtype=np.float64), theta=labels + [labels[0]],
+        fill="toself", fillcolor="rgba(167,139,250,0.18)", line=dict(color="#a78bfa", width=2.5),
+    ))
+    fig_radar.update_layout(polar=dict(bgcolor="rgba(0,0,0,0)", radialaxis=dict(visible=True, range=[0, 1])), paper_bgcolor="rgba(0,0,0,0)", height=350)
+    return fig_radar.to_dict()
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def compute_booking_curve(item_id: int, ref: date, n_events: int, _events=None):
+    """選択商品の累積ブッキングカーブを (x, y) で返す（間引き済み）。
+
+    フィルタ・cumsum・間引きは入力が変わらない限り再計算しない。
+    n_events がイベント表の実質的なキャッシュキー（_events はハッシュ対象外）。
+    該当イベントがなければ None。
+    """
+    ev = _events[_events["inventory_id"] == item_id].sort_values("booked_at")
+    ev = ev[ev["booked_at"].dt.date <= ref]
+    if ev.empty:
+        return None
+    return downsample_series(
+        ev["booked_at"].to_numpy(),
+        ev["quantity"].cumsum().to_numpy(dtype=np.int64),
+    )
+
+def downsample_series(x, y, n_max: int = 2000):
+    """描画点数を n_max 以下に間引く（先頭・末尾は必ず残す）。
+
+    予約イベント系列は無制限に伸びるため、ブラウザへ渡す点数をここで
+    打ち止めにする。累積カーブのような単調系列なら等間隔の間引きで
+    輪郭は十分保たれる。n_max 以下ならそのまま返す。
+    """
+    n = len(x)
+    if n <= n_max:
+        return x, y
+    idx = np.linspace(0, n - 1, n_max).astype(np.int64)
+    return x[idx], y[idx]
+
+def compute_scores_batch(inv_ratio, lead_days, elasticity, vr, remaining_stock, total_stock) -> np.ndarray:
+    """商品カルテの5軸スコアを全商品分まとめて計算し (N, 5) 配列で返す。
+
+    列は (在庫切迫度, 時間切迫度, 販売速度, 価格弾力性, バンドル適性)。
+    商品ごとの Python 演算の代わりに ndarray の列演算で一括計算する
+    （この規模ではスレッド並列化よりベクトル化 1 本の方が速く、依存も増えない）。
+    lead_days の欠損（出発日未設定）は単品ロジックと同じ扱い
+    （時間切迫度は 90 日相当、バンドル適性は 0）に揃えてある。
+    """
+    inv_ratio = np.asarray(inv_ratio, dtype=np.float64)
+    lead = np.array([np.nan if l is None else float(l) for l in lead_days])
+    elast = np.asarray(elasticity, dtype=np.float64)
+    vr = np.asarray(vr, dtype=np.float64)
+    rems = np.asarray(remaining_stock, dtype=np.float64)
+    totals = np.asarray(total_stock, dtype=np.float64)
+
+    inv_urgency = 1.0 - inv_ratio
+    time_urgency = np.maximum(0.0, 1.0 - np.where(np.isnan(lead), 90.0, lead) / 60.0)
+    vel_score = np.minimum(np.nan_to_num(vr) / 3.0, 1.0)
+    p_elast = np.minimum(np.abs(elast) / 3.0, 1.0)
+    # hotel_urgency_score と同じ式（在庫率 0.7 + 時間要因 0.3）
+    stock_ratio = np.where(totals > 0, rems / np.maximum(totals, 1.0), 0.0)
+    bundle = np.where(
+        np.isnan(lead), 0.0,
+        stock_ratio * 0.7 + np.maximum(0.0, 1.0 - np.nan_to_num(lead) / 30.0) * 0.3,
+    )
+    return np.column_stack([inv_urgency, time_urgency, vel_score, p_elast, bundle])
+
+def format_departure_labels(recs: list[dict]) -> list[str]:
+    """推奨リストの出発日 (YYYY-MM-DD) を「M/D」表示へ一括変換する。
+
+    ループ内での strptime 呼び出しを避け、pd.to_datetime で一度に
+    パースする。パースできない値は元の文字列のまま返す。
+    """
+    raw = [(r.get("departure_date") or "---") for r in recs]
+    parsed = pd.to_datetime([d[:10] for d in raw], errors="coerce")
+    return [
+        dt.strftime("%-m/%-d") if not pd.isna(dt) else d
+        for dt, d in zip(parsed, raw)
+    ]
+
 def get_pricing_results(inv_df: pd.DataFrame, config: dict = None, strategy: str = "rule_based", reference_date: date = None) -> list[dict]:
-    import sys
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-    from pricing_engine import calculate_pricing_result
-    results = []
-    for _, row in inv_df.iterrows():
-        r = calculate_pricing_result(
-            inventory_id    = int(row["id"]),
-            name            = row["name"],
-            base_price      = int(row["base_price"]),
-            total_stock     = int(row["total_stock"]),
-            remaining_stock = int(row["remaining_stock"]),
-            departure_date  = row.get("departure_date"),
-            elasticity      = row.get("elasticity", -1.5),
-            config          = config,
-            strategy        = strategy,
-            reference_date  = reference_date,
-        )
-        results.append(r)
-    return results
+    # キャッシュ境界は _compute_pricing 側（ttl=60）。この薄いラッパーは
+    # rerun ごとに走るが、行タプルへの凍結だけなのでコストは無視できる。
+    # iterrows() は行ごとに Series を生成するため遅い。必要列を ndarray として
+    # 一括で取り出し、zip で行タプルに凍結する（DataFrame/dict はハッシュ
+    # 不能のため、st.cache_data のキーにできる形へ変換してから渡す）。
+    n_rows = len(inv_df)
+    ids, names, bases, totals, rems = (
+        inv_df[c].to_numpy() for c in ["id", "name", "base_price", "total_stock", "remaining_stock"]
+    )
+    deps = inv_df["departure_date"].to_numpy() if "departure_date" in inv_df.columns else [None] * n_rows
+    elas = inv_df["elasticity"].to_numpy() if "elasticity" in inv_df.columns else [-1.5] * n_rows
+    rows = tuple(zip(ids, names, bases, totals, rems, deps, elas))
+    config_key = tuple(sorted((config or {}).items()))
+    return _compute_pricing(rows, config_key, strategy, reference_date)
 
 
 
@@ -122,8 +372,14 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ─── データロード ─────────────────────────────────────────────────
-inv_df     = load_inventory()
-history_df = load_history()
+inv_df = load_inventory()
+
+if not inv_df.empty:
+    # 在庫数は int64 で持つ必要がないため int32 に落とし、Arrow / Plotly JSON の
+    # 直列化バイト数を抑える（res_df 側の数値列も同様に downcast 済み）
+    inv_df[["total_stock", "remaining_stock"]] = inv_df[["total_stock", "remaining_stock"]].astype(np.int32)
+    # 充足率（remaining/total）は複数タブで参照するため、ロード直後に 1 回だけ列演算しておく
+    inv_df["fill_ratio"] = inv_df["remaining_stock"] / inv_df["total_stock"].where(inv_df["total_stock"] > 0, 1)
 
 if inv_df.empty:
     st.error("⚠️ 在庫データが見つかりません。`python init_db.py` を先に実行してください。")
@@ -204,10 +460,13 @@ if not selected_dates:
 else:
     filtered_inv_df = inv_df[inv_df["departure_date"].isin(selected_dates)].copy()
 
-# UI表示用に「商品名 (日付)」のカラムを作成
-filtered_inv_df["display_name"] = filtered_inv_df.apply(
-    lambda x: f"{x['name']} ({x['departure_date']})", axis=1
+# UI表示用に「商品名 (日付)」のカラムを作成（行ごとの apply ではなく列演算で）
+filtered_inv_df["display_name"] = (
+    filtered_inv_df["name"].astype(str) + " (" + filtered_inv_df["departure_date"].astype(str) + ")"
 )
+# カード表示用の短縮名もここで一括生成（rerun ごとの Python スライスを避ける）
+filtered_inv_df["name_20"] = filtered_inv_df["name"].astype(str).str.slice(0, 20)
+filtered_inv_df["name_18"] = filtered_inv_df["name"].astype(str).str.slice(0, 18)
 
 # ─── 基準日（Virtual Today）に基づく在庫の再計算とフィルタリング ───
 v_today = st.session_state.get("virtual_today", datetime.now(timezone.utc).date())
@@ -231,41 +490,72 @@ if not all_events.empty and not filtered_inv_df.empty:
         filtered_inv_df["remaining_stock"] = filtered_inv_df["remaining_stock"] + filtered_inv_df["quantity"]
         filtered_inv_df.drop(columns=["inventory_id", "quantity"], inplace=True)
 
+# remaining_stock を基準日時点に巻き戻したので、充足率もここで再計算する
+# （ロード直後の fill_ratio のままだと Virtual Today 変更時に古い値が残る）
+if not filtered_inv_df.empty:
+    filtered_inv_df["fill_ratio"] = (
+        filtered_inv_df["remaining_stock"] / filtered_inv_df["total_stock"].where(filtered_inv_df["total_stock"] > 0, 1)
+    )
+
 target_ids = filtered_inv_df["id"].tolist()
 
+# id → 行 の O(1) ルックアップ用インデックス。各タブのループ内で
+# `filtered_inv_df[filtered_inv_df["id"] == x]` の全列スキャンを繰り返さない。
+inv_by_id = filtered_inv_df.set_index("id", drop=False)
+
 strategy_val = st.session_state.get("pricing_strategy", "rule_based")
+# 在庫・設定・戦略・基準日が変わらない rerun（サイドバー操作の大半）では
+# _compute_pricing のキャッシュに当たり、エンジン再計算は走らない
 results = get_pricing_results(filtered_inv_df, config=ai_config, strategy=strategy_val, reference_date=v_today)
-log_price_history(results, DB_PATH)
-history_df = load_history() # 履歴を再読み込みして最新化
-
-# 履歴データもフィルタリング (基準日以前のものだけ表示)
-if not history_df.empty:
-    history_df = history_df[history_df["inventory_id"].isin(target_ids)]
-    history_df = history_df[history_df["recorded_at"].dt.date <= v_today]
-
-# ─── パッケージエンジン読み込み（全タブ共通） ─────────────────────
-curr_scenario = st.session_state.get("market_scenario", "base")
-try:
-    roi_metrics = calculate_roi_metrics(inventory_ids=target_ids, reference_date=v_today)
-    rescue_metrics = calculate_inventory_rescue_metrics(inventory_ids=target_ids, reference_date=v_today)
-    
-    # --- Prescriptive Analytics (Phase 14 / Phase 27) ---
-    # AI現在価格（時価）をマッピングしてエンジンに渡す
-    current_prices = {r["inventory_id"]: r["final_price"] for r in results}
-    optimal_strategy = calculate_optimal_strategy(
-        scenario=curr_scenario, 
-        inventory_ids=target_ids,
-        current_prices=current_prices,
-        reference_date=v_today
-    )
-except Exception as _e:
-    packages = []
-    roi_metrics = {"lift": 0, "lift_pct": 0, "total_fixed": 0, "total_dynamic": 0, "daily_data": []}
-    rescue_metrics = {"overall_rescue_rate": 0, "rescued_units": 0, "hotel_rescue_rate": 0, "total_units": 0}
-    optimal_strategy = {"recommendations": [], "total_standalone_profit": 0, "total_optimized_profit": 0, "ai_impact": 0}
-    _pkg_err = str(_e)
-    st.warning(f"分析エンジンの初期化に失敗しました: {_pkg_err}")
 
+# id → PricingResult / 時価 のマップを一度だけ構築し、各タブでの
+# `next(r for r in results if ...)` 線形探索を O(1) 参照に置き換える
+res_idx = {r["inventory_id"]: r for r in results}
+
+# results は各タブで表としても使われるため、ここで一度だけ DataFrame 化して
+# 使い回す（タブ内での再構築を避ける）。金額・比率の数値列は int32/float32 に
+# 寄せ、メモリと Plotly への転送量を抑える。
+res_df = pd.DataFrame(results)
+if not res_df.empty:
+    res_df = res_df.astype({
+        "base_price": "int32", "final_price": "int32",
+        "inventory_adjustment": "int32", "time_adjustment": "int32",
+        "inv_ratio": "float32",
+    })
+
+# 販売速度はアラート・一覧テーブル・カルテが同じ (id, 在庫, lead) で参照する
+# ため、rerun ごとに 1 回だけバッチ計算して共有する。入力が変わらない rerun
+# では session_state の前回値を使い、booking_events クエリ自体を省く。
+_vel_sig = (
+    tuple(target_ids),
+    tuple(int(x) for x in filtered_inv_df["remaining_stock"]),
+    v_today,
+)
+_vel_cached = st.session_state.get("vel_cache")
+if _vel_cached is not None and _vel_cached["sig"] == _vel_sig:
+    vel_map = _vel_cached["map"]
+else:
+    try:
+        _vr_all = get_velocity_ratio_batch(
+            filtered_inv_df["id"].to_numpy(),
+            filtered_inv_df["total_stock"].to_numpy(),
+            filtered_inv_df["remaining_stock"].to_numpy(),
+            [res_idx[int(i)]["lead_days"] for i in filtered_inv_df["id"]],
+            reference_date=v_today,
+        )
+    except Exception:
+        _vr_all = np.full(len(filtered_inv_df), np.nan)
+    vel_map = {
+        int(i): (None if np.isnan(v) else float(v))
+        for i, v in zip(filtered_inv_df["id"], _vr_all)
+    }
+    st.session_state["vel_cache"] = {"sig": _vel_sig, "map": vel_map}
+current_prices = {inv_id: r["final_price"] for inv_id, r in res_idx.items()}
+log_price_history(results, get_rw_conn())
+# 価格履歴はここでは再読み込みしない。消費するタブが現れた時点で
+# load_history(tuple(target_ids)) を呼べば十分（現状の5タブは未使用）。
+# 商品別に系列を描くときは name ごとの boolean フィルタではなく
+# df.groupby("name", sort=False) の 1 パスで分割すること。
 
 # ─── 5タブ構成 ──────────────────────────────
 tabs = [
@@ -277,6 +567,33 @@ tabs = [
 ]
 selected_tab = st.radio("MainNavigation", tabs, horizontal=True, label_visibility="collapsed", key="main_nav_tab")
 
+# ─── パッケージエンジン読み込み ─────────────────────────────────
+# 各メトリクスは消費するタブが選択されているときだけ計算する。
+# （タブ本体は st.radio で遅延化済みのため、ここが残る重い共通処理）
+curr_scenario = st.session_state.get("market_scenario", "base")
+roi_metrics = {"lift": 0, "lift_pct": 0, "total_fixed": 0, "total_dynamic": 0, "daily_data": []}
+rescue_metrics = {"overall_rescue_rate": 0, "rescued_units": 0, "hotel_rescue_rate": 0, "total_units": 0}
+optimal_strategy = {"recommendations": [], "total_standalone_profit": 0, "total_optimized_profit": 0, "ai_impact": 0}
+try:
+    if selected_tab in ("📈 Executive Summary", "🎯 Today's Action"):
+        roi_metrics = cached_roi_metrics(tuple(target_ids), ref=v_today)
+    if selected_tab in ("📈 Executive Summary", "📦 Strategy Map"):
+        rescue_metrics = cached_rescue_metrics(tuple(target_ids), ref=v_today)
+
+    # --- Prescriptive Analytics (Phase 14 / Phase 27) ---
+    # AI現在価格（時価）をマッピングしてエンジンに渡す
+    if selected_tab in ("🎯 Today's Action", "📦 Strategy Map"):
+        optimal_strategy = cached_optimal_strategy(
+            curr_scenario,
+            tuple(target_ids),
+            tuple(sorted(current_prices.items())),
+            ref=v_today
+        )
+except Exception as _e:
+    packages = []
+    _pkg_err = str(_e)
+    st.warning(f"分析エンジンの初期化に失敗しました: {_pkg_err}")
+
 
 # ══════════════════════════════════════════════════════════════════
 # Tab 1: 【観察】エグゼクティブ・サマリ (Observe)
@@ -305,11 +622,11 @@ if selected_tab == "📈 Executive Summary":
     else:
         hist_start, hist_end = min_date_val, max_date_val
 
-    roi_metrics = calculate_roi_metrics(
-        inventory_ids=target_ids,
-        target_start_date=hist_start.isoformat(),
-        target_end_date=hist_end.isoformat(),
-        reference_date=v_today
+    roi_metrics = cached_roi_metrics(
+        tuple(target_ids),
+        start=hist_start.isoformat(),
+        end=hist_end.isoformat(),
+        ref=v_today
     )
 
     # --- [NEW] 需要予測・着地点セクション ---
@@ -317,40 +634,47 @@ if selected_tab == "📈 Executive Summary":
     st.markdown("### 🔮 ビジネス着地点予測 (End-of-Term Forecast)")
     st.markdown(f'<p class="section-description">※選択中のシナリオ: <b>{curr_scenario.upper()}</b> に基づく Day 0 までの予測</p>', unsafe_allow_html=True)
     
-    # 全商品の予測を集計
+    # 全商品の予測を一括集計（商品ごとの SQL + Python ループを 1 バッチ呼び出しに）
     total_expected_profit = 0
     total_unsold = 0
-    for r in results:
-        inv = filtered_inv_df[filtered_inv_df["id"] == r["inventory_id"]].iloc[0]
-        # 原価（cost）を base_price * 0.5 と仮定した簡易コスト算出
-        forecast = calculate_demand_forecast(r["inventory_id"], r["lead_days"], int(inv["remaining_stock"]), int(inv["total_stock"]), r["base_price"], int(r["base_price"]*0.5), reference_date=v_today)
-        total_expected_profit += forecast[curr_scenario]["expected_profit"]
-        total_unsold += forecast[curr_scenario]["unsold_stock"]
-
-    f_col1, f_col2, f_col3 = st.columns(3)
-    with f_col1:
-        st.markdown(f"""
-        <div class="metric-card">
+    if results:
+        f_ids = res_df["inventory_id"].tolist()
+        f_base = res_df["base_price"].to_numpy()
+        forecast_df = calculate_demand_forecast_batch(
+            inventory_ids   = f_ids,
+            lead_days       = [r["lead_days"] for r in results],
+            remaining_stock = inv_by_id.loc[f_ids, "remaining_stock"].to_numpy(),
+            total_stock     = inv_by_id.loc[f_ids, "total_stock"].to_numpy(),
+            base_price      = f_base,
+            # 原価（cost）を base_price * 0.5 と仮定した簡易コスト算出
+            cost            = (f_base * 0.5).astype(int),
+            reference_date  = v_today,
+        )
+        total_expected_profit = forecast_df[f"expected_profit_{curr_scenario}"].sum()
+        total_unsold = forecast_df[f"unsold_stock_{curr_scenario}"].sum()
+
+    # st.columns + カードごとの markdown（デルタ3往復）ではなく、
+    # flex コンテナにまとめて 1 回の markdown で描画する
+    risk_level = "高" if total_unsold > 50 else ("中" if total_unsold > 20 else "低")
+    risk_color = "#f87171" if risk_level == "高" else ("#fbbf24" if risk_level == "中" else "#4ade80")
+    st.markdown(f"""
+    <div style="display:flex; gap:16px; align-items:stretch;">
+        <div class="metric-card" style="flex:1;">
             <div class="metric-label" style="color:var(--text-heading) !important;">見込み最終純利益</div>
             <div class="metric-value" style="color:#10b981; font-size:1.8rem;">¥{int(total_expected_profit):,}</div>
             <div class="metric-sub">前回比: +¥{int(total_expected_profit - roi_metrics['total_dynamic']):,}</div>
-        </div>""", unsafe_allow_html=True)
-    with f_col2:
-        st.markdown(f"""
-        <div class="metric-card">
+        </div>
+        <div class="metric-card" style="flex:1;">
             <div class="metric-label" style="color:var(--text-heading) !important;">予測売れ残り数</div>
             <div class="metric-value" style="color:#f87171; font-size:1.8rem;">{int(total_unsold)} units</div>
             <div class="metric-sub">Day 0 到着時の余剰在庫</div>
-        </div>""", unsafe_allow_html=True)
-    with f_col3:
-        risk_level = "高" if total_unsold > 50 else ("中" if total_unsold > 20 else "低")
-        risk_color = "#f87171" if risk_level == "高" else ("#fbbf24" if risk_level == "中" else "#4ade80")
-        st.markdown(f"""
-        <div class="metric-card">
+        </div>
+        <div class="metric-card" style="flex:1;">
             <div class="metric-label" style="color:var(--text-heading) !important;">在庫破棄リスク</div>
             <div class="metric-value" style="color:{risk_color}; font-size:1.8rem;">{risk_level}</div>
             <div class="metric-sub">売れ残り予測に基づく判定</div>
-        </div>""", unsafe_allow_html=True)
+        </div>
+    </div>""", unsafe_allow_html=True)
 
     
     
@@ -362,38 +686,11 @@ if selected_tab == "📈 Executive Summary":
     col_chart, col_donut = st.columns([2, 1])
     with col_chart:
         st.markdown("#### 📈 累積売上と廃棄損の推移：固定 vs 動的")
-        df_daily = pd.DataFrame(roi_metrics["daily_data"])
-        if not df_daily.empty:
-            df_daily["cum_dyn_sales"] = df_daily.get("day_dyn_sales", 0).cumsum()
-            df_daily["cum_dyn_waste"] = df_daily.get("day_dyn_waste", 0).cumsum()
-            df_daily["cum_fix_sales"] = df_daily.get("day_fix_sales", 0).cumsum()
-            df_daily["cum_fix_waste"] = df_daily.get("day_fix_waste", 0).cumsum()
-
-            fig_roi = go.Figure()
-            
-            # 1. 動的価格・売上 (Green, solid/filled)
-            fig_roi.add_trace(go.Scatter(
-                x=df_daily["day"], y=df_daily["cum_dyn_sales"], name="動的価格・売上 (実績)",
-                mode='lines+markers', line=dict(color='#10b981', width=3),
-                fill='tozeroy', fillcolor='rgba(16,185,129,0.1)'
-            ))
-            # 2. 固定価格・売上 (Blue, dashed)
-            fig_roi.add_trace(go.Scatter(
-                x=df_daily["day"], y=df_daily["cum_fix_sales"], name="固定価格・売上 (想定)",
-                mode='lines', line=dict(color='#0ea5e9', width=2, dash='dash')
-            ))
-            # 3. 固定価格・廃棄損 (Orange, dashed)
-            fig_roi.add_trace(go.Scatter(
-                x=df_daily["day"], y=df_daily["cum_fix_waste"], name="固定価格・廃棄損 (想定)",
-                mode='lines', line=dict(color='#fb923c', width=2, dash='dash')
-            ))
-            # 4. 動的価格・廃棄損 (Red, solid) - グラフ上で比較対象として明示
-            fig_roi.add_trace(go.Scatter(
-                x=df_daily["day"], y=df_daily["cum_dyn_waste"], name="動的価格・廃棄損 (実績)",
-                mode='lines+markers', line=dict(color='#f43f5e', width=3)
-            ))
-            
-            dark_layout(fig_roi, "累積売上と廃棄損の推移", yaxis_title="累積金額 (円)")
+        daily_data = roi_metrics["daily_data"]
+        if daily_data:
+            # dict のままではキャッシュキーにできないため tuple に凍結して渡す
+            frozen_daily = tuple(tuple(sorted(d.items())) for d in daily_data)
+            fig_roi = go.Figure(build_roi_figure_dict(frozen_daily))
             st.plotly_chart(fig_roi, use_container_width=True, key="summary_roi_chart")
         else:
             st.info("📊 ROI分析用の販売データがまだ蓄積されていません。")
@@ -422,9 +719,16 @@ if selected_tab == "📈 Executive Summary":
 # ══════════════════════════════════════════════════════════════════
 if selected_tab == "🎯 Today's Action":
     def get_velocity_ratio_with_ref(inv_id, ts, rs, ld):
-        return get_velocity_ratio(inv_id, ts, rs, ld, reference_date=v_today)
-        
-    render_alerts(results, filtered_inv_df, [], get_velocity_ratio_with_ref)
+        # 商品ごとの SQL を発行せず、共有の vel_map から引く
+        return vel_map.get(int(inv_id))
+
+    # 結果の中身が変わらない rerun ではアラート再計算をスキップする
+    res_key = tuple(
+        (r["inventory_id"], r["final_price"], r.get("is_brake_active", False)) for r in results
+    )
+    render_alerts_prebuilt(
+        cached_alerts(res_key, v_today, _results=results, _inv_df=filtered_inv_df, _fn=get_velocity_ratio_with_ref)
+    )
 
     st.markdown(f"""
     <div style="background:linear-gradient(135deg,#0f172a 0%,#1e293b 100%); border:1px solid rgba(56,189,248,0.4); border-radius:20px; padding:24px; margin-top:20px; margin-bottom:20px; box-shadow:0 0 30px rgba(56,189,248,0.15);">
@@ -500,17 +804,16 @@ if selected_tab == "🎯 Today's Action":
         st.info("商品データがないため、推奨アクションを計算できませんでした。")
     else:
         # パッケージ推奨カード（緑系）― 出発日インパクト順に表示
-        sorted_bundle_recs = sorted(bundle_recs, key=lambda r: r.get("gain", 0), reverse=True)
-        for rec in sorted_bundle_recs:
+        # itemgetter は C 実装のため、要素ごとに Python の lambda を呼ぶより速い
+        sorted_bundle_recs = sorted(bundle_recs, key=itemgetter("gain"), reverse=True)
+        # 日付表示用の整形（YYYY-MM-DD → M/D）はループの外で一括変換
+        bundle_labels = format_departure_labels(sorted_bundle_recs)
+        # カードごとに st.markdown を呼ぶと枚数分の delta 送信と DOM 再構築が走るため、
+        # HTML を連結して 1 回で描画する
+        bundle_cards = []
+        for rec, dep_label in zip(sorted_bundle_recs, bundle_labels):
             item_icon = "🏨" if rec["item_type"] == "hotel" else "✈️"
-            dep_date  = rec.get("departure_date", "---")
-            # 日付表示用に整形（YYYY-MM-DD → M/D）
-            try:
-                from datetime import datetime as _dt
-                dep_label = _dt.strptime(dep_date[:10], "%Y-%m-%d").strftime("%-m/%-d")
-            except Exception:
-                dep_label = dep_date
-            st.markdown(f"""
+            bundle_cards.append(f"""
             <div style="background:rgba(16,185,129,0.08); border:1px solid rgba(16,185,129,0.5); border-radius:14px; padding:18px; margin:8px 0;">
                 <div style="display:flex; gap:10px; align-items:center; margin-bottom:8px; flex-wrap:wrap;">
                     <div style="background:#10b981; color:#fff; border-radius:8px; padding:4px 10px; font-size:0.75rem; font-weight:900; white-space:nowrap;">
@@ -530,26 +833,26 @@ if selected_tab == "🎯 Today's Action":
                 </div>
                 <div style="font-size:0.85rem; color:#e2e8f0;">{rec['reason']}</div>
             </div>
-            """, unsafe_allow_html=True)
+            """)
+        if bundle_cards:
+            st.markdown("".join(bundle_cards), unsafe_allow_html=True)
 
         # 単品維持カード（グレー系）
         with st.expander(f"⚪ 単品維持 ({len(standalone_recs)}商品) — 現行価格を維持"):
-            for rec in standalone_recs:
+            standalone_labels = format_departure_labels(standalone_recs)
+            standalone_cards = []
+            for rec, dep_label in zip(standalone_recs, standalone_labels):
                 item_icon = "🏨" if rec["item_type"] == "hotel" else "✈️"
-                dep_date  = rec.get("departure_date", "---")
-                try:
-                    from datetime import datetime as _dt
-                    dep_label = _dt.strptime(dep_date[:10], "%Y-%m-%d").strftime("%-m/%-d")
-                except Exception:
-                    dep_label = dep_date
-                st.markdown(f"""
+                standalone_cards.append(f"""
                 <div style="background:rgba(100,116,139,0.1); border:1px solid rgba(100,116,139,0.4); border-radius:10px; padding:12px; margin:6px 0; display:flex; gap:10px; align-items:center; flex-wrap:wrap;">
                     <span style="background:rgba(99,102,241,0.15); color:#a5b4fc; border-radius:6px; padding:2px 8px; font-size:0.75rem; font-weight:700;">📅 {dep_label}</span>
                     <span style="font-weight:700; color:#e2e8f0;">{item_icon} {rec['item_name']}</span>
                     <span style="color:#e2e8f0; font-size:0.85rem;">現行価格: ¥{rec['optimal_price']:,}</span>
                     <div style="width:100%; font-size:0.8rem; color:#cbd5e1; margin-top:4px;">{rec['reason']}</div>
                 </div>
-                """, unsafe_allow_html=True)
+                """)
+            if standalone_cards:
+                st.markdown("".join(standalone_cards), unsafe_allow_html=True)
 
     st.markdown("---")
 
@@ -563,126 +866,142 @@ if selected_tab == "🔍 Analysis & Tracking":
     st.markdown("#### 🎯 対象商品の詳細分析")
     
     # 簡易テーブルの作成
-    table_data = []
-    for r in results:
-        inv_matches = filtered_inv_df[filtered_inv_df["id"] == r["inventory_id"]]
-        if inv_matches.empty: continue
-        inv = inv_matches.iloc[0]
-        try:
-            vr = get_velocity_ratio(r["inventory_id"], int(inv["total_stock"]), int(inv["remaining_stock"]), r["lead_days"], reference_date=v_today)
-            status = "🚨 Over" if vr > 1.5 else ("⚠️ Slow" if vr < 0.6 else "✅ Normal")
-        except: vr, status = 0, "---"
-        
-        table_data.append({
-            "商品名": inv["name"],
-            "販売速度": f"{vr:.2f}x",
-            "ステータス": status,
-            "時価": f"¥{r['final_price']:,}",
-            "残庫": f"{int(inv['remaining_stock'])}/{int(inv['total_stock'])}",
-            "ID": r["inventory_id"]
-        })
-    
-    table_df = pd.DataFrame(table_data)
-    
-    # 選択
-    selected_item_id = st.selectbox(
-        "詳細分析する商品を選択してください", 
-        table_df["ID"].tolist(), 
-        format_func=lambda x: table_df[table_df["ID"]==x]["商品名"].iloc[0],
-        key="global_item_selector"
+    # 結果ごとの boolean フィルタ (O(N^2)) を避け、merge 一発で在庫情報を突合する。
+    # 派生列（ステータス・表示用文字列）も商品ごとの Python 演算ではなく
+    # 結合済み DataFrame / ndarray からの一括生成で済ませる。
+    # res_df はモジュールレベルで一度だけ実体化済み。
+    merged = filtered_inv_df.merge(res_df, left_on="id", right_on="inventory_id", suffixes=("", "_r"))
+
+    # 共有の vel_map（rerun ごとに 1 回のバッチ計算）から全行分を引き当てる
+    vr_arr = merged["inventory_id"].map(vel_map).to_numpy(dtype=float)
+    status_arr = np.select(
+        [np.isnan(vr_arr), vr_arr > 1.5, vr_arr < 0.6],
+        ["---", "🚨 Over", "⚠️ Slow"],
+        default="✅ Normal"
+    )
+    vr_disp = np.nan_to_num(vr_arr)
+
+    # カルテ用 5 軸スコアも全商品分ここで一括計算しておく（選択のたびの
+    # 再計算と追加の velocity クエリを避ける）
+    scores_mat = compute_scores_batch(
+        merged["inv_ratio"].to_numpy(),
+        merged["lead_days"].tolist(),
+        merged["elasticity"].to_numpy(),
+        vr_arr,
+        merged["remaining_stock"].to_numpy(),
+        merged["total_stock"].to_numpy(),
     )
-    
-    st.markdown("---")
 
-    # --- 選ばれた商品の詳細分析 (旧ドリルダウン) ---
-    r_sel = next(r for r in results if r["inventory_id"] == selected_item_id)
-    inv_sel = filtered_inv_df[filtered_inv_df["id"] == selected_item_id].iloc[0]
+    table_df = pd.DataFrame({
+        "商品名": merged["name"].to_numpy(),
+        "販売速度": [f"{v:.2f}x" for v in vr_disp],
+        "ステータス": status_arr,
+        "時価": [f"¥{p:,}" for p in merged["final_price"]],
+        "残庫": [f"{int(r)}/{int(t)}" for r, t in zip(merged["remaining_stock"], merged["total_stock"])],
+        "ID": merged["inventory_id"].to_numpy(),
+    })
     
-    all_events = load_booking_events()
-    item_events = all_events[all_events["inventory_id"] == selected_item_id].sort_values("booked_at")
-
-    col_radar, col_info = st.columns([1.2, 1], gap="large")
-    with col_radar:
-        st.markdown(f"#### 🃏 商品カルテ")
-        inv_urgency   = 1.0 - r_sel["inv_ratio"]
-        time_urgency  = max(0.0, 1.0 - (r_sel["lead_days"] or 90) / 60.0)
-        p_elast       = min(abs(r_sel["elasticity"]) / 3.0, 1.0) # 弾力性（絶対値）のスコア化
-        try:
-            vr_k = get_velocity_ratio(r_sel["inventory_id"], int(inv_sel["total_stock"]), int(inv_sel["remaining_stock"]), r_sel["lead_days"], reference_date=v_today)
-            vel_score = min((vr_k or 0.0) / 3.0, 1.0)
-        except: vel_score = 0
-        try: bundle_score = hotel_urgency_score(int(inv_sel["remaining_stock"]), int(inv_sel["total_stock"]), r_sel["lead_days"])
-        except: bundle_score = 0
-
-        radar_labels = ["在庫切迫度", "時間切迫度", "販売速度", "価格弾力性", "バンドル適性"]
-        radar_scores = [inv_urgency, time_urgency, vel_score, p_elast, bundle_score]
-        fig_radar = go.Figure(go.Scatterpolar(
-            r=radar_scores + [radar_scores[0]], theta=radar_labels + [radar_labels[0]],
-            fill="toself", fillcolor="rgba(167,139,250,0.18)", line=dict(color="#a78bfa", width=2.5),
-        ))
-        fig_radar.update_layout(polar=dict(bgcolor="rgba(0,0,0,0)", radialaxis=dict(visible=True, range=[0, 1])), paper_bgcolor="rgba(0,0,0,0)", height=350)
-        st.plotly_chart(fig_radar, use_container_width=True, key="tracking_radar_chart")
+    # 商品選択とその詳細パネルは fragment として切り出す。セレクトボックスの
+    # 変更時はスクリプト全体ではなくこのパネルだけが再実行される
+    @st.fragment
+    def _detail_panel():
+        # 選択
+        # format_func での boolean フィルタ（選択肢ごとの O(N) スキャン）を避け、
+        # id → 商品名の辞書を 1 回だけ作って引く
+        name_by_id = dict(zip(table_df["ID"], table_df["商品名"]))
+        selected_item_id = st.selectbox(
+            "詳細分析する商品を選択してください",
+            table_df["ID"].tolist(),
+            format_func=name_by_id.get,
+            key="global_item_selector"
+        )
     
-    with col_info:
-        st.markdown(f"#### ℹ️ {inv_sel['name']}")
-        st.markdown(f'<div class="karte-card">', unsafe_allow_html=True)
-        st.markdown(f"**動的価格:** ¥{r_sel['final_price']:,}")
-        st.markdown(f"**価格偏差:** {'+' if r_sel['final_price']>=r_sel['base_price'] else ''}¥{r_sel['final_price']-r_sel['base_price']:,}")
-        st.markdown(f"**残在庫:** {int(inv_sel['remaining_stock'])}/{int(inv_sel['total_stock'])} ({int(r_sel['inv_ratio']*100)}%)")
-        st.markdown(f"**価格弾力性:** {r_sel.get('elasticity', -1.5)}")
-        st.markdown(f'<div class="reason-box">{r_sel["reason"]}</div>', unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-
-    # 価格形成 WF とブッキングカーブ
-    col_wf, col_curve = st.columns(2)
-    with col_wf:
-        st.markdown("#### 🌊 価格形成プロセス")
-        if "waterfall" in r_sel and r_sel["waterfall"]:
-            wf_data = r_sel["waterfall"]
-            wf_labels = [item["label"] for item in wf_data]
-            wf_values = [item["value"] for item in wf_data]
-            wf_measure = [item["measure"] for item in wf_data]
-
-            fig_wf = go.Figure(go.Waterfall(
-                measure=wf_measure,
-                x=wf_labels, y=wf_values,
-                increasing=dict(marker=dict(color="#f87171")),
-                decreasing=dict(marker=dict(color="#4ade80")),
-                totals=dict(marker=dict(color="#a78bfa")),
-            ))
-        else:
-            wf_labels = ["在庫調整", "時期調整", "速度調整", "合計調整"]
-            vel_adj = r_sel['final_price'] - (r_sel['base_price'] + r_sel.get('inventory_adjustment', 0) + r_sel.get('time_adjustment', 0))
-            wf_values = [r_sel.get("inventory_adjustment", 0), r_sel.get("time_adjustment", 0), vel_adj, (r_sel['final_price'] - r_sel['base_price'])]
-            fig_wf = go.Figure(go.Waterfall(
-                measure=["relative", "relative", "relative", "total"],
-                x=wf_labels, y=wf_values,
-                increasing=dict(marker=dict(color="#f87171")),
-                decreasing=dict(marker=dict(color="#4ade80")),
-                totals=dict(marker=dict(color="#a78bfa")),
-            ))
+        st.markdown("---")
+
+        # --- 選ばれた商品の詳細分析 (旧ドリルダウン) ---
+        r_sel = res_idx[selected_item_id]
+        inv_sel = inv_by_id.loc[selected_item_id]
+        # all_events はモジュールレベルでロード済み（在庫再計算で使用）を再利用
+
+        col_radar, col_info = st.columns([1.2, 1], gap="large")
+        with col_radar:
+            st.markdown(f"#### 🃏 商品カルテ")
+            # 一括計算済みの scores_mat から選択行を取り出す（再計算なし）
+            sel_pos = int(np.flatnonzero(merged["inventory_id"].to_numpy() == selected_item_id)[0])
+            radar_labels = ("在庫切迫度", "時間切迫度", "販売速度", "価格弾力性", "バンドル適性")
+            radar_scores = tuple(float(s) for s in scores_mat[sel_pos])
+            fig_radar = go.Figure(build_radar_figure_dict(radar_scores, radar_labels))
+            st.plotly_chart(fig_radar, use_container_width=True, key="tracking_radar_chart")
+    
+        with col_info:
+            # 同じキーを f-string 内で何度も引かないよう、先にローカルへ束縛する
+            fp, bp = r_sel["final_price"], r_sel["base_price"]
+            st.markdown(f"#### ℹ️ {inv_sel['name']}")
+            st.markdown(f'<div class="karte-card">', unsafe_allow_html=True)
+            st.markdown(f"**動的価格:** ¥{fp:,}")
+            st.markdown(f"**価格偏差:** {'+' if fp >= bp else ''}¥{fp - bp:,}")
+            st.markdown(f"**残在庫:** {int(inv_sel['remaining_stock'])}/{int(inv_sel['total_stock'])} ({int(r_sel['inv_ratio']*100)}%)")
+            st.markdown(f"**価格弾力性:** {r_sel.get('elasticity', -1.5)}")
+            st.markdown(f'<div class="reason-box">{r_sel["reason"]}</div>', unsafe_allow_html=True)
+            st.markdown('</div>', unsafe_allow_html=True)
+
+        # 価格形成 WF とブッキングカーブ
+        col_wf, col_curve = st.columns(2)
+        with col_wf:
+            st.markdown("#### 🌊 価格形成プロセス")
+            if "waterfall" in r_sel and r_sel["waterfall"]:
+                wf_data = r_sel["waterfall"]
+                wf_labels = [item["label"] for item in wf_data]
+                # 数値列は ndarray で渡す（Plotly の JSON 化が typed array 経路になる）
+                wf_values = np.asarray([item["value"] for item in wf_data], dtype=np.int64)
+                wf_measure = [item["measure"] for item in wf_data]
+
+                fig_wf = go.Figure(go.Waterfall(
+                    measure=wf_measure,
+                    x=wf_labels, y=wf_values,
+                    increasing=dict(marker=dict(color="#f87171")),
+                    decreasing=dict(marker=dict(color="#4ade80")),
+                    totals=dict(marker=dict(color="#a78bfa")),
+                ))
+            else:
+                wf_labels = ["在庫調整", "時期調整", "速度調整", "合計調整"]
+                inv_adj = r_sel.get("inventory_adjustment", 0)
+                time_adj = r_sel.get("time_adjustment", 0)
+                vel_adj = fp - (bp + inv_adj + time_adj)
+                wf_values = np.asarray([inv_adj, time_adj, vel_adj, fp - bp], dtype=np.int64)
+                fig_wf = go.Figure(go.Waterfall(
+                    measure=["relative", "relative", "relative", "total"],
+                    x=wf_labels, y=wf_values,
+                    increasing=dict(marker=dict(color="#f87171")),
+                    decreasing=dict(marker=dict(color="#4ade80")),
+                    totals=dict(marker=dict(color="#a78bfa")),
+                ))
         
-        dark_layout(fig_wf)
-        st.plotly_chart(fig_wf, use_container_width=True, key="tracking_wf_chart_unique")
+            dark_layout(fig_wf)
+            st.plotly_chart(fig_wf, use_container_width=True, key="tracking_wf_chart_unique")
+
+        with col_curve:
+            st.markdown("#### 📈 ブッキング傾向")
+
+            # フィルタ・累積和・間引きは ttl=60 のキャッシュ側で 1 回だけ行う
+            curve = compute_booking_curve(int(selected_item_id), v_today, len(all_events), _events=all_events)
+
+            if curve is not None:
+                curve_x, curve_y = curve
+                # 点数が多いときは SVG ではなく WebGL (Scattergl) で描く
+                _curve_scatter = go.Scattergl if len(curve_x) > 500 else go.Scatter
+                fig_curve = go.Figure()
+                fig_curve.add_trace(_curve_scatter(
+                    x=curve_x, y=curve_y,
+                    mode="lines+markers", line=dict(color="#a78bfa", width=3),
+                    fill="tozeroy", fillcolor="rgba(167,139,250,0.1)"
+                ))
+                dark_layout(fig_curve)
+                st.plotly_chart(fig_curve, use_container_width=True, key="tracking_curve_chart_unique")
+            else:
+                st.info("販売データがありません")
 
-    with col_curve:
-        st.markdown("#### 📈 ブッキング傾向")
-        
-        # 基準日までのイベントのみにフィルタリング
-        item_events_filtered = item_events[item_events["booked_at"].dt.date <= v_today].copy()
-        
-        if not item_events_filtered.empty:
-            item_events_filtered["cum_sales"] = item_events_filtered["quantity"].cumsum()
-            fig_curve = go.Figure()
-            fig_curve.add_trace(go.Scatter(
-                x=item_events_filtered["booked_at"], y=item_events_filtered["cum_sales"],
-                mode="lines+markers", line=dict(color="#a78bfa", width=3),
-                fill="tozeroy", fillcolor="rgba(167,139,250,0.1)"
-            ))
-            dark_layout(fig_curve)
-            st.plotly_chart(fig_curve, use_container_width=True, key="tracking_curve_chart_unique")
-        else:
-            st.info("販売データがありません")
+    _detail_panel()
     st.markdown("---")
     st.markdown("#### 🚚 商品一覧 & 異常検知")
     st.dataframe(table_df, use_container_width=True, hide_index=True)
@@ -696,35 +1015,34 @@ if selected_tab == "📦 Strategy Map":
     with col_map:
         st.markdown("#### 🗺 パッケージ・シナジー・マップ")
         # バブルチャートで「在庫切迫度」x「利益改善額」を可視化
-        bubble_data = []
-        for rec in optimal_strategy["recommendations"]:
-            if rec["strategy"] == "bundle":
-                h_id = rec.get("item_id")
-                inv_matches = filtered_inv_df[filtered_inv_df["id"] == h_id]
-                r_matches = [r for r in results if r["inventory_id"] == h_id]
-                urg = 0.5
-                if not inv_matches.empty and r_matches:
-                    inv = inv_matches.iloc[0]
-                    r_h = r_matches[0]
-                    try:
-                        from packaging_engine import hotel_urgency_score
-                        urg = hotel_urgency_score(int(inv["remaining_stock"]), int(inv["total_stock"]), r_h.get("lead_days", 90))
-                    except: pass
-
-                bubble_data.append({
-                    "name": rec["item_name"],
-                    "urgency": urg,
-                    "lift": rec["gain"],
-                    "score": min(100, 20 + (rec["gain"] / 5000)) # スコア（バブルサイズ）も利益に応じて変動
-                })
-        if bubble_data:
-            b_df = pd.DataFrame(bubble_data)
+        # （推奨ごとの Python append ではなく DataFrame フィルタ + 列演算で構築）
+        recs_df = pd.DataFrame(optimal_strategy["recommendations"])
+        b_df = recs_df[recs_df["strategy"].eq("bundle")].copy() if not recs_df.empty else recs_df
+        if not b_df.empty:
+            joined = b_df.merge(
+                inv_by_id[["id", "fill_ratio"]].reset_index(drop=True),
+                left_on="item_id", right_on="id", how="left"
+            )
+            lead_map = {i: (r["lead_days"] if r["lead_days"] is not None else 90) for i, r in res_idx.items()}
+            lead = joined["item_id"].map(lead_map).fillna(90).to_numpy(dtype=float)
+            inv_ratio = joined["fill_ratio"].to_numpy(dtype=float)
+            # hotel_urgency_score と同じ 0.7/0.3 加重。在庫情報が引けない行は従来通り 0.5
+            time_factor = np.maximum(0.0, 1.0 - lead / 30.0)
+            urgency = np.where(np.isnan(inv_ratio), 0.5, inv_ratio * 0.7 + time_factor * 0.3)
+            gains = joined["gain"].to_numpy(dtype=float)
+            b_df = pd.DataFrame({
+                "name": joined["item_name"].to_numpy(),
+                "urgency": urgency,
+                "lift": gains,
+                "score": np.minimum(100, 20 + gains / 5000)  # スコア（バブルサイズ）も利益に応じて変動
+            })
+        if not b_df.empty:
             fig_bubble = go.Figure(data=[go.Scatter(
-                x=b_df["urgency"], y=b_df["lift"],
+                x=b_df["urgency"].to_numpy(), y=b_df["lift"].to_numpy(),
                 mode='markers+text',
                 text=b_df["name"],
                 textposition="top center",
-                marker=dict(size=b_df["score"], color=b_df["lift"], colorscale='Viridis', showscale=True)
+                marker=dict(size=b_df["score"].to_numpy(), color=b_df["lift"].to_numpy(), colorscale='Viridis', showscale=True)
             )])
             dark_layout(fig_bubble, "在庫切迫度 vs 利益改善リフト", yaxis_title="期待利益改善額 (円)")
             fig_bubble.update_layout(xaxis_title="在庫切迫度スコア (1.0=緊急)")
@@ -746,9 +1064,9 @@ if selected_tab == "📦 Strategy Map":
         
         if pairing_data:
             # 利益順に並び替え (Plotlyの横棒は下から上へ描画されるため昇順ソート)
-            pairing_data = sorted(pairing_data, key=lambda x: x["gain"])
+            pairing_data = sorted(pairing_data, key=itemgetter("gain"))
             pairs = [p["pair"] for p in pairing_data]
-            gains = [p["gain"] for p in pairing_data]
+            gains = np.asarray([p["gain"] for p in pairing_data], dtype=np.int64)
             texts = [p["text"] for p in pairing_data]
 
             fig_bar = go.Figure(go.Bar(
@@ -789,11 +1107,324 @@ if selected_tab == "📦 Strategy Map":
         st.markdown(f"""
         <div class="metric-card">
             <div class="metric-label">自動調整発動数</div>
-            <div class="metric-value">{len([r for r in results if r.get('is_brake_active')])}</div>
+            <div class="metric-value">{sum(1 for r in results if r.get('is_brake_active'))}</div>
         </div>
         """, unsafe_allow_html=True)
 
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def compute_past_actuals(h_id: int, f_id: int, h_total: int, f_total: int,
+                         h_base: float, f_base: float, h_dep: str, f_dep: str,
+                         h_proc: str, f_proc: str, ref: date, lead_days: int,
+                         n_events: int, _events=None) -> dict:
+    """販売開始日〜基準日の実績系列を日次集計する。
+
+    ホテル・フライト・基準日にしか依存しないため、割引や負担割合の
+    スライダー変更による rerun ではキャッシュが返り、日次ループは走らない。
+    （_events はハッシュ対象外。内容の変化は n_events と ttl で拾う）
+    """
+    # 1. 販売開始日の特定とリードタイム算出
+    dep_dt = pd.to_datetime(h_dep or f_dep)
+
+    try:
+        h_proc_dt = pd.to_datetime(h_proc)
+        h_lead = (dep_dt.date() - h_proc_dt.date()).days
+    except Exception:
+        h_lead = 90
+
+    try:
+        f_proc_dt = pd.to_datetime(f_proc)
+        f_lead = (dep_dt.date() - f_proc_dt.date()).days
+    except Exception:
+        f_lead = 90
+
+    total_lead_days = max(h_lead, f_lead)
+
+    # 過去時系列用配列の初期化
+    past_x = []
+    past_revenue = []
+    past_revenue_h = []
+    past_revenue_f = []
+    past_potential_waste = []
+
+    # 過去イベントのフィルタリング（タイムゾーン影響を防ぐためDate型で比較）
+    if _events is not None and not _events.empty:
+        booked_dates = pd.to_datetime(_events["booked_at"]).dt.date
+        past_mask = booked_dates <= ref
+        past_events_h = _events[(_events["inventory_id"] == h_id) & past_mask]
+        past_events_f = _events[(_events["inventory_id"] == f_id) & past_mask]
+    else:
+        past_events_h = pd.DataFrame()
+        past_events_f = pd.DataFrame()
+
+    # 初期状態
+    total_initial_cost = (h_total * h_base * 0.9) + (f_total * f_base * 0.9)
+    cum_rev = 0
+    cum_rev_h = 0
+    cum_rev_f = 0
+    current_h_stk = h_total
+    current_f_stk = f_total
+
+    # 日次で集計ループ
+    # d は 出発日までの残り日数 (total_lead_days -> lead_days)
+    # つまり、古い日付から現在に向かって進むループにする必要がある
+
+    # タイムゾーン等の影響を排除するため、イベント側の日付をDate型または文字列(YYYY-MM-DD)に前処理しておく
+    if not past_events_h.empty:
+        past_events_h = past_events_h.copy()
+        past_events_h["booked_date_str"] = pd.to_datetime(past_events_h["booked_at"]).dt.strftime("%Y-%m-%d")
+    if not past_events_f.empty:
+        past_events_f = past_events_f.copy()
+        past_events_f["booked_date_str"] = pd.to_datetime(past_events_f["booked_at"]).dt.strftime("%Y-%m-%d")
+
+    for d in range(total_lead_days, lead_days, -1):
+        current_date_dt = dep_dt - timedelta(days=d)
+        current_date_str = current_date_dt.strftime("%Y-%m-%d")
+        past_x.append(f"D-{d}")
+
+        # ホテルの集計 (販売開始日以降のみ記録)
+        if d <= h_lead:
+            if not past_events_h.empty:
+                day_sales_h = past_events_h[past_events_h["booked_date_str"] == current_date_str]
+                sales_val_h = day_sales_h["sold_price"].sum()
+                cum_rev += sales_val_h
+                cum_rev_h += sales_val_h
+                current_h_stk -= day_sales_h["quantity"].sum()
+            past_revenue_h.append(cum_rev_h)
+        else:
+            past_revenue_h.append(None)
+
+        # フライトの集計 (販売開始日以降のみ記録)
+        if d <= f_lead:
+            if not past_events_f.empty:
+                day_sales_f = past_events_f[past_events_f["booked_date_str"] == current_date_str]
+                sales_val_f = day_sales_f["sold_price"].sum()
+                cum_rev += sales_val_f
+                cum_rev_f += sales_val_f
+                current_f_stk -= day_sales_f["quantity"].sum()
+            past_revenue_f.append(cum_rev_f)
+        else:
+            past_revenue_f.append(None)
+
+        # 全体合算と含み損
+        if d <= max(h_lead, f_lead):
+            past_revenue.append(cum_rev)
+            pw = (current_h_stk * h_base * 0.9) + (current_f_stk * f_base * 0.9)
+            past_potential_waste.append(pw)
+        else:
+            past_revenue.append(None)
+            past_potential_waste.append(None)
+
+    return {
+        "past_x": past_x,
+        "past_revenue": past_revenue,
+        "past_revenue_h": past_revenue_h,
+        "past_revenue_f": past_revenue_f,
+        "past_potential_waste": past_potential_waste,
+        "total_initial_cost": total_initial_cost,
+    }
+
+@st.cache_data(ttl=60, max_entries=32, show_spinner=False)
+def build_sim_figure_dict(fig_key: tuple, total_initial_cost: float, max_y: float,
+                          _series: dict = None) -> dict:
+    """P/L 予測チャートを構築し、キャッシュ可能な dict 形式で返す。
+
+    系列データは _series（ハッシュ対象外）の ndarray をゼロコピーで受け取り、
+    キャッシュキーは系列を決定づけるスカラーの組 fig_key で代表する。
+    """
+    past_x = _series["past_x"]
+    past_rev = _series["past_rev"]
+    past_rev_h = _series["past_rev_h"]
+    past_rev_f = _series["past_rev_f"]
+    past_waste = _series["past_waste"]
+    days_x_bridged = _series["days_x_bridged"]
+    n_rev_h, n_rev_f, n_rev = _series["n_rev_h"], _series["n_rev_f"], _series["n_rev"]
+    a_rev_h, a_rev_f, a_rev = _series["a_rev_h"], _series["a_rev_f"], _series["a_rev"]
+    b_rev_h, b_rev_f, b_rev = _series["b_rev_h"], _series["b_rev_f"], _series["b_rev"]
+    waste_b = _series["waste_b"]
+    full_x = _series["full_x"]
+    from plotly.subplots import make_subplots
+    fig_sim = make_subplots(specs=[[{"secondary_y": True}]])
+
+    # 長期のタイムラインは SVG だと DOM ノードが嵩むため WebGL 描画に切り替える
+    # （短期はクリスプな SVG を維持）
+    _scatter = go.Scattergl if len(full_x) > 30 else go.Scatter
+
+    # 総仕入原価（水平線）
+    total_costs_line = [total_initial_cost] * len(full_x)
+    fig_sim.add_trace(_scatter(
+        x=full_x, y=total_costs_line, name="総仕入原価 (損益分岐点)",
+        line=dict(color='rgba(255,255,255,0.7)', width=2, dash='dash')
+    ), secondary_y=False)
+
+    # ─── 過去実績部分 ───
+    if past_x:
+        # 実績 ホテル単体
+        fig_sim.add_trace(_scatter(
+            x=past_x, y=past_rev_h, name="🏨 累積売上実績 (ホテル)",
+            line=dict(color='rgba(96, 165, 250, 0.6)', width=2) # blue-400
+        ), secondary_y=False)
+        # 実績 フライト単体
+        fig_sim.add_trace(_scatter(
+            x=past_x, y=past_rev_f, name="✈️ 累積売上実績 (フライト)",
+            line=dict(color='rgba(192, 132, 252, 0.6)', width=2) # purple-400
+        ), secondary_y=False)
+        # 実績 全体合算
+        fig_sim.add_trace(_scatter(
+            x=past_x, y=past_rev, name="💰 累積売上実績 (全体合算)",
+            line=dict(color='#cbd5e1', width=3)
+        ), secondary_y=False)
+        
+        # 実績 含み損
+        fig_sim.add_trace(_scatter(
+            x=past_x, y=past_waste, name="含み廃棄損リスク (実績)",
+            line=dict(color='#94a3b8', width=2, dash='dot')
+        ), secondary_y=True)
+
+    # ─── 未来予測部分 (シナリオN: ナイーブ・現状推移) ───
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=n_rev_h, name="🏨 予測売上 (現状推移・ホテル)",
+        line=dict(color='rgba(148, 163, 184, 0.4)', width=2, dash='dot') # slate-400
+    ), secondary_y=False)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=n_rev_f, name="✈️ 予測売上 (現状推移・フライト)",
+        line=dict(color='rgba(148, 163, 184, 0.4)', width=2, dash='dot') # slate-400
+    ), secondary_y=False)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=n_rev, name="💰 予測売上 全体 (現状推移)",
+        line=dict(color='rgba(148, 163, 184, 0.6)', width=2, dash='dash')
+    ), secondary_y=False)
+
+    # ─── 未来予測部分 (シナリオA: 単体維持) ───
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=a_rev_h, name="🏨 予測売上 (ホテル・シナリオA)",
+        line=dict(color='rgba(248, 113, 113, 0.4)', width=2, dash='dot') # red-400
+    ), secondary_y=False)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=a_rev_f, name="✈️ 予測売上 (フライト・シナリオA)",
+        line=dict(color='rgba(251, 146, 60, 0.4)', width=2, dash='dot') # orange-400
+    ), secondary_y=False)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=a_rev, name="💰 予測売上 全体 (シナリオA)",
+        line=dict(color='#f87171', width=3, dash='dot')
+    ), secondary_y=False)
+
+    # ─── 未来予測部分 (シナリオB: ハイブリッド) ───
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=b_rev_h, name="🏨 予測売上 (ホテル・シナリオB)",
+        line=dict(color='rgba(52, 211, 153, 0.6)', width=2) # emerald-400
+    ), secondary_y=False)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=b_rev_f, name="✈️ 予測売上 (フライト・シナリオB)",
+        line=dict(color='rgba(45, 212, 191, 0.6)', width=2) # teal-400
+    ), secondary_y=False)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=b_rev, name="💰 予測売上 全体 (シナリオB)",
+        line=dict(color='#4ade80', width=4)
+    ), secondary_y=False)
+
+    # 含み廃棄損 (未来予測 B)
+    fig_sim.add_trace(_scatter(
+        x=days_x_bridged, y=waste_b, name="予測含み廃棄損 (シナリオB)",
+        fill='tozeroy', fillcolor='rgba(74,222,128,0.1)',
+        line=dict(color='#4ade80', width=2, dash='dot')
+    ), secondary_y=True)
+
+    # 基準日（V-Line）
+    if past_x:
+        fig_sim.add_vline(x=past_x[-1], line_width=2, line_dash="dash", line_color="#a78bfa")
+        fig_sim.add_annotation(
+            x=past_x[-1], y=1.0, yref="paper",
+            text="本日 (実績/予測 境界)",
+            showarrow=False,
+            font=dict(color="#a78bfa", size=10),
+            xanchor="right", yanchor="bottom"
+        )
+
+    # ─── その他の補助線（マイルストーン） ───
+    # 例：D-30 (パッケージ用キャンセル無料終了の目安)
+    d30_label = "D-30"
+    if d30_label in full_x:
+        fig_sim.add_vline(x=d30_label, line_width=1, line_dash="dot", line_color="rgba(148, 163, 184, 0.5)")
+        fig_sim.add_annotation(
+            x=d30_label, y=0.05, yref="paper",
+            text="D-30",
+            showarrow=False,
+            font=dict(color="rgba(148, 163, 184, 0.8)", size=10),
+            xanchor="left", yanchor="bottom"
+        )
+        
+    # 例：D-14 (単品航空券需要ピークなど)
+    d14_label = "D-14"
+    if d14_label in full_x:
+        fig_sim.add_vline(x=d14_label, line_width=1, line_dash="dot", line_color="rgba(148, 163, 184, 0.5)")
+        fig_sim.add_annotation(
+            x=d14_label, y=0.05, yref="paper",
+            text="D-14",
+            showarrow=False,
+            font=dict(color="rgba(148, 163, 184, 0.8)", size=10),
+            xanchor="left", yanchor="bottom"
+        )
+
+    # レイアウト調整
+    dark_layout(fig_sim, secondary_y=True)
+    fig_sim.update_layout(
+        title="P/L 予測シミュレーション（実績＋将来予測）",
+        xaxis=dict(
+            title="タイムライン（右端 = 期限・出発日 D-0）",
+            gridcolor="#1e293b",
+            dtick=10 if len(full_x) > 30 else 5
+        ),
+        hovermode="x unified",
+        height=500
+    )
+    fig_sim.update_yaxes(title_text="累積金額 (円)", secondary_y=False, range=[0, max_y], gridcolor="#1e293b", tickformat=",d")
+    fig_sim.update_yaxes(title_text="含み廃棄損 (円)", secondary_y=True, range=[0, max_y], gridcolor="rgba(0,0,0,0)", showticklabels=False, tickformat=",d")
+    return fig_sim.to_dict()
+
+# 「AI 戦略アドバイス」ブロックは固定文面のため、パース済みテンプレートとして
+# モジュールレベルに一度だけ用意しておく（substitute は f-string 再構築より軽い）
+_ADVICE_TMPL = string.Template("""
+<div style='background:rgba(30,27,75,0.4); border:1px solid rgba(167,139,250,0.4); border-radius:10px; padding:15px; margin-top:20px; margin-bottom:20px;'>
+    <h5 style='margin-top:0;'>💡 AI 戦略アドバイス</h5>
+    <p style='font-size:0.9rem; color:#e2e8f0;'>
+        シナリオAでは <b>${unsold_a}個</b> の売れ残りが発生し、仕入原価 <b>¥${unsold_cost}</b> が丸損となる予測です。<br>
+        パッケージ化（シナリオB）では販売速度を <b>${vel_boost}件/日</b> まで引き上げることで、売れ残り数を <b>${unsold_b}個</b> まで圧縮します。
+        フライトのカニバリゼーションを考慮しても、この在庫リスク回避が <b>¥${diff}</b> の利益貢献につながります。
+    </p>
+</div>
+""")
+
 # 🧪 Tab 5: Custom Simulator
+# パッケージ価格構成カードの HTML 骨格（rerun ごとの f-string 再構築を避けるため
+# モジュールレベルの定数テンプレートにし、変動する値だけを format で流し込む）
+_PKG_CARD_TMPL = """
+<div style='flex:2; background:rgba(99,102,241,0.1); border:1px solid #6366f1; border-radius:12px; padding:15px;'>
+    <div style='font-size:0.75rem; color:#818cf8; margin-bottom:8px; letter-spacing:0.05em;'>ἄ8 パッケージ価格構成</div>
+    <table style='width:100%; font-size:0.85rem; border-collapse:collapse;'>
+        <tr>
+            <td style='padding:4px 0; color:#e2e8f0;'>🏨 {h_name}</td>
+            <td style='text-align:right; color:#e2e8f0;'>¥{h_price:,}</td>
+            <td style='text-align:right; color:#f87171; font-size:0.75rem;'>&nbsp;(-¥{h_disc:,})</td>
+        </tr>
+        <tr>
+            <td style='padding:4px 0; color:#e2e8f0;'>✈️ {f_name}</td>
+            <td style='text-align:right; color:#e2e8f0;'>¥{f_price:,}</td>
+            <td style='text-align:right; color:#f87171; font-size:0.75rem;'>&nbsp;(-¥{f_disc:,})</td>
+        </tr>
+        <tr style='border-top:1px solid #334155;'>
+            <td style='padding:8px 0 4px; color:#818cf8; font-weight:700;'>🎁 定価合計</td>
+            <td style='text-align:right; color:#818cf8; font-size:0.9rem; font-weight:600;'>¥{pkg_before:,}</td>
+            <td></td>
+        </tr>
+        <tr>
+            <td style='padding:4px 0; color:#4ade80; font-weight:700;'>🏷️ 割引後パッケージ価格</td>
+            <td style='text-align:right; color:#4ade80; font-size:1.2rem; font-weight:900;'>¥{pkg_after:,}</td>
+            <td></td>
+        </tr>
+    </table>
+</div>
+"""
+
 if selected_tab == "🧪 Custom Simulator":
     st.markdown("### 🧪 カスタム・シミュレーター（時系列シナリオ分析）")
     st.markdown('<p class="section-description">「今すぐパッケージで売り切る」vs「単品で粘る」の利益推移を描画し、在庫の価値が消える前に打つべき最適解を導き出します。</p>', unsafe_allow_html=True)
@@ -802,23 +1433,22 @@ if selected_tab == "🧪 Custom Simulator":
     with st.container():
         # ─── Step 1: 出発日選択（最上位フィルタ）───────────────────────
         # ホテルとフライト両方が存在する日付のみを選択肢に出す
-        h_dates = set(filtered_inv_df[filtered_inv_df["item_type"]=="hotel"]["departure_date"].dropna().tolist())
-        f_dates = set(filtered_inv_df[filtered_inv_df["item_type"]=="flight"]["departure_date"].dropna().tolist())
+        # （item_type ごとの boolean フィルタ 2 回ではなく groupby 1 パスで集合化）
+        type_dates = filtered_inv_df.dropna(subset=["departure_date"]).groupby("item_type")["departure_date"].agg(set)
+        h_dates = type_dates.get("hotel", set())
+        f_dates = type_dates.get("flight", set())
         common_dates = sorted(h_dates & f_dates)  # 両方に在庫がある日付のみ
 
         if not common_dates:
             st.warning("⚠️ ホテルとフライト両方の在庫がある出発日が見つかりません。")
             st.stop()
 
-        # 表示ラベルを「M/D (YYYY-MM-DD)」形式に
-        from datetime import datetime as _sim_dt
-        def _fmt_date(d: str) -> str:
-            try:
-                return _sim_dt.strptime(d[:10], "%Y-%m-%d").strftime("%-m/%-d (%Y-%m-%d)")
-            except Exception:
-                return str(d)
-
-        date_labels    = [_fmt_date(d) for d in common_dates]
+        # 表示ラベルを「M/D (YYYY-MM-DD)」形式に（一括パース）
+        parsed_dates = pd.to_datetime([str(d)[:10] for d in common_dates], errors="coerce")
+        date_labels = [
+            dt.strftime("%-m/%-d (%Y-%m-%d)") if not pd.isna(dt) else str(d)
+            for dt, d in zip(parsed_dates, common_dates)
+        ]
         date_label_map = dict(zip(date_labels, common_dates))
 
         sel_date_label = st.selectbox(
@@ -856,17 +1486,21 @@ if selected_tab == "🧪 Custom Simulator":
     st.markdown("---")
     
     # パラメータ（グローバル調整）
-    c_p1, c_p2 = st.columns([1, 1], gap="large")
-    with c_p1:
-        total_discount = st.slider("💰 パッケージ割引総額 (円)", 0, 20000, 8000, step=500, key="sim_discount")
-    with c_p2:
-        split_ratio = st.slider("🤝 割引負担の割合 (ホテル負担 %)", 0, 100, 80, help="ホテルの在庫が重い場合は、ホテルの負担を増やしてフライト側の利益（単品売上の期待値）を守ります。", key="sim_split")
+    # form で囲むことで、スライダーのドラッグ中の中間値では rerun せず
+    # 「実行」ボタンを押したタイミングでのみシミュレーションを回す
+    with st.form("sim_form"):
+        c_p1, c_p2 = st.columns([1, 1], gap="large")
+        with c_p1:
+            total_discount = st.slider("💰 パッケージ割引総額 (円)", 0, 20000, 8000, step=500, key="sim_discount")
+        with c_p2:
+            split_ratio = st.slider("🤝 割引負担の割合 (ホテル負担 %)", 0, 100, 80, help="ホテルの在庫が重い場合は、ホテルの負担を増やしてフライト側の利益（単品売上の期待値）を守ります。", key="sim_split")
+        st.form_submit_button("🔄 シミュレーション実行", use_container_width=True)
 
     if target_hotel is not None and target_flight is not None:
         # --- 2. シミュレーションエンジンの実行 ---
-        # A. 基礎データの取得
-        f_pricing = next((r for r in results if r["inventory_id"] == target_flight["id"]), None)
-        h_pricing = next((r for r in results if r["inventory_id"] == target_hotel["id"]), None)
+        # A. 基礎データの取得（results の線形スキャンではなく dict インデックスで O(1) 参照）
+        f_pricing = res_idx.get(target_flight["id"])
+        h_pricing = res_idx.get(target_hotel["id"])
         
         lead_days = f_pricing["lead_days"] or 30
         h_stock = target_hotel["remaining_stock"]
@@ -888,78 +1522,65 @@ if selected_tab == "🧪 Custom Simulator":
         pkg_price_after_disc  = pkg_price_before_disc - total_discount
 
         st.markdown("#### 📊 選択中のコンビネーション概要")
-        si_col1, si_col2, si_col3 = st.columns([2, 1, 1], gap="medium")
-
-        with si_col1:
-            st.markdown(f"""
-            <div style='background:rgba(99,102,241,0.1); border:1px solid #6366f1; border-radius:12px; padding:15px;'>
-                <div style='font-size:0.75rem; color:#818cf8; margin-bottom:8px; letter-spacing:0.05em;'>ἄ8 パッケージ価格構成</div>
-                <table style='width:100%; font-size:0.85rem; border-collapse:collapse;'>
-                    <tr>
-                        <td style='padding:4px 0; color:#e2e8f0;'>🏨 {target_hotel['name'][:20]}</td>
-                        <td style='text-align:right; color:#e2e8f0;'>¥{h_price:,}</td>
-                        <td style='text-align:right; color:#f87171; font-size:0.75rem;'>&nbsp;(-¥{int(h_discount):,})</td>
-                    </tr>
-                    <tr>
-                        <td style='padding:4px 0; color:#e2e8f0;'>✈️ {target_flight['name'][:20]}</td>
-                        <td style='text-align:right; color:#e2e8f0;'>¥{f_price:,}</td>
-                        <td style='text-align:right; color:#f87171; font-size:0.75rem;'>&nbsp;(-¥{int(f_discount):,})</td>
-                    </tr>
-                    <tr style='border-top:1px solid #334155;'>
-                        <td style='padding:8px 0 4px; color:#818cf8; font-weight:700;'>🎁 定価合計</td>
-                        <td style='text-align:right; color:#818cf8; font-size:0.9rem; font-weight:600;'>¥{pkg_price_before_disc:,}</td>
-                        <td></td>
-                    </tr>
-                    <tr>
-                        <td style='padding:4px 0; color:#4ade80; font-weight:700;'>🏷️ 割引後パッケージ価格</td>
-                        <td style='text-align:right; color:#4ade80; font-size:1.2rem; font-weight:900;'>¥{pkg_price_after_disc:,}</td>
-                        <td></td>
-                    </tr>
-                </table>
-            </div>
-            """, unsafe_allow_html=True)
-
-        with si_col2:
-            h_stock_pct = int(h_stock / target_hotel['total_stock'] * 100) if target_hotel['total_stock'] else 0
-            f_stock_pct = int(f_stock / target_flight['total_stock'] * 100) if target_flight['total_stock'] else 0
-            st.markdown(f"""
-            <div style='background:rgba(15,23,42,0.8); border:1px solid #1e293b; border-radius:12px; padding:15px; height:100%;'>
-                <div style='font-size:0.75rem; color:#818cf8; margin-bottom:10px; letter-spacing:0.05em;'>📦 現在の残件数</div>
-                <div style='margin-bottom:10px;'>
-                    <div style='font-size:0.75rem; color:#e2e8f0;'>🏨 ホテル</div>
-                    <div style='font-size:1.4rem; font-weight:800; color:#e2e8f0;'>{h_stock}<span style='font-size:0.75rem; color:#e2e8f0;'> / {target_hotel['total_stock']}室</span></div>
-                    <div style='background:#1e293b; border-radius:4px; height:6px; margin-top:4px;'>
-                        <div style='background:#6366f1; height:6px; border-radius:4px; width:{h_stock_pct}%;'></div>
-                    </div>
-                    <div style='font-size:0.7rem; color:#cbd5e1; margin-top:2px;'>残存率 {h_stock_pct}%</div>
-                </div>
-                <div>
-                    <div style='font-size:0.75rem; color:#e2e8f0;'>✈️ フライト</div>
-                    <div style='font-size:1.4rem; font-weight:800; color:#e2e8f0;'>{f_stock}<span style='font-size:0.75rem; color:#e2e8f0;'> / {target_flight['total_stock']}席</span></div>
-                    <div style='background:#1e293b; border-radius:4px; height:6px; margin-top:4px;'>
-                        <div style='background:#6366f1; height:6px; border-radius:4px; width:{f_stock_pct}%;'></div>
-                    </div>
-                    <div style='font-size:0.7rem; color:#cbd5e1; margin-top:2px;'>残存率 {f_stock_pct}%</div>
+        # 3 カードを 1 回の markdown 書き込み（flex コンテナ）にまとめ、
+        # フロントエンドへのデルタ送信を 1 回に抑える
+        card1_html = _PKG_CARD_TMPL.format(
+            h_name=target_hotel['name_20'], f_name=target_flight['name_20'],
+            h_price=h_price, f_price=f_price,
+            h_disc=int(h_discount), f_disc=int(f_discount),
+            pkg_before=pkg_price_before_disc, pkg_after=pkg_price_after_disc,
+        )
+
+        # f-string 内で繰り返し参照する値はローカルに束縛しておく
+        h_total = target_hotel['total_stock']
+        f_total = target_flight['total_stock']
+        h_dep_label = target_hotel.get('departure_date', '---')
+        f_dep_label = target_flight.get('departure_date', '---')
+        h_stock_pct = int(h_stock / h_total * 100) if h_total else 0
+        f_stock_pct = int(f_stock / f_total * 100) if f_total else 0
+        card2_html = f"""
+        <div style='flex:1; background:rgba(15,23,42,0.8); border:1px solid #1e293b; border-radius:12px; padding:15px;'>
+            <div style='font-size:0.75rem; color:#818cf8; margin-bottom:10px; letter-spacing:0.05em;'>📦 現在の残件数</div>
+            <div style='margin-bottom:10px;'>
+                <div style='font-size:0.75rem; color:#e2e8f0;'>🏨 ホテル</div>
+                <div style='font-size:1.4rem; font-weight:800; color:#e2e8f0;'>{h_stock}<span style='font-size:0.75rem; color:#e2e8f0;'> / {h_total}室</span></div>
+                <div style='background:#1e293b; border-radius:4px; height:6px; margin-top:4px;'>
+                    <div style='background:#6366f1; height:6px; border-radius:4px; width:{h_stock_pct}%;'></div>
                 </div>
+                <div style='font-size:0.7rem; color:#cbd5e1; margin-top:2px;'>残存率 {h_stock_pct}%</div>
             </div>
-            """, unsafe_allow_html=True)
-
-        with si_col3:
-            st.markdown(f"""
-            <div style='background:rgba(15,23,42,0.8); border:1px solid #1e293b; border-radius:12px; padding:15px; height:100%;'>
-                <div style='font-size:0.75rem; color:#818cf8; margin-bottom:10px; letter-spacing:0.05em;'>⏳ 出発まで {lead_days}日</div>
-                <div style='margin-bottom:8px;'>
-                    <div style='font-size:0.75rem; color:#e2e8f0;'>🪨 対象ホテル</div>
-                    <div style='font-size:0.8rem; color:#e2e8f0;'>{target_hotel['name'][:18]}</div>
-                    <div style='font-size:0.7rem; color:#cbd5e1;'>出発日: {target_hotel.get('departure_date', '---')}</div>
-                </div>
-                <div>
-                    <div style='font-size:0.75rem; color:#e2e8f0;'>✈ 対象フライト</div>
-                    <div style='font-size:0.8rem; color:#e2e8f0;'>{target_flight['name'][:18]}</div>
-                    <div style='font-size:0.7rem; color:#cbd5e1;'>出発日: {target_flight.get('departure_date', '---')}</div>
+            <div>
+                <div style='font-size:0.75rem; color:#e2e8f0;'>✈️ フライト</div>
+                <div style='font-size:1.4rem; font-weight:800; color:#e2e8f0;'>{f_stock}<span style='font-size:0.75rem; color:#e2e8f0;'> / {f_total}席</span></div>
+                <div style='background:#1e293b; border-radius:4px; height:6px; margin-top:4px;'>
+                    <div style='background:#6366f1; height:6px; border-radius:4px; width:{f_stock_pct}%;'></div>
                 </div>
+                <div style='font-size:0.7rem; color:#cbd5e1; margin-top:2px;'>残存率 {f_stock_pct}%</div>
+            </div>
+        </div>
+        """
+
+        card3_html = f"""
+        <div style='flex:1; background:rgba(15,23,42,0.8); border:1px solid #1e293b; border-radius:12px; padding:15px;'>
+            <div style='font-size:0.75rem; color:#818cf8; margin-bottom:10px; letter-spacing:0.05em;'>⏳ 出発まで {lead_days}日</div>
+            <div style='margin-bottom:8px;'>
+                <div style='font-size:0.75rem; color:#e2e8f0;'>🪨 対象ホテル</div>
+                <div style='font-size:0.8rem; color:#e2e8f0;'>{target_hotel['name_18']}</div>
+                <div style='font-size:0.7rem; color:#cbd5e1;'>出発日: {h_dep_label}</div>
             </div>
-            """, unsafe_allow_html=True)
+            <div>
+                <div style='font-size:0.75rem; color:#e2e8f0;'>✈ 対象フライト</div>
+                <div style='font-size:0.8rem; color:#e2e8f0;'>{target_flight['name_18']}</div>
+                <div style='font-size:0.7rem; color:#cbd5e1;'>出発日: {f_dep_label}</div>
+            </div>
+        </div>
+        """
+
+        st.markdown(
+            "<div style='display:flex; gap:12px; align-items:stretch;'>"
+            + card1_html + card2_html + card3_html + "</div>",
+            unsafe_allow_html=True,
+        )
 
         st.markdown("<br>", unsafe_allow_html=True)
         
@@ -1004,114 +1625,35 @@ if selected_tab == "🧪 Custom Simulator":
         # 市場シナリオを取得
         market_condition = st.session_state.get("market_scenario", "base")
         
-        # 共通関数呼び出し
-        sim_res = simulate_sales_scenario(
-            h_item_sim, f_item_sim, int(total_discount), lead_days, market_condition, reference_date=v_today
+        # 共通関数呼び出し（入力が同じスライダー操作・無関係な rerun ではキャッシュが返る）
+        sim_res = cached_simulation(
+            tuple(sorted(h_item_sim.items())), tuple(sorted(f_item_sim.items())),
+            int(total_discount), lead_days, market_condition, ref=v_today
         )
-        history = sim_res["history"]
-        
-        # グラフ用データの抽出
-        days_x = [f"D-{h['day_idx']}" for h in history]
-        scenario_a_revenue = [h["revenue_a"] for h in history]
-        scenario_b_revenue = [h["revenue_b"] for h in history]
-        potential_waste_a = [h["potential_waste_a"] for h in history]
-        potential_waste_b = [h["potential_waste_b"] for h in history]
+        hist = sim_res["history"]  # 列ごとの np.ndarray (SoA)
+        n_hist = len(hist["day_idx"])
 
-        # ─── 過去実績の集計 (販売開始日〜基準日) ───
-        # 1. 販売開始日の特定とリードタイム算出
-        dep_dt = pd.to_datetime(target_hotel.get("departure_date", "") or target_flight.get("departure_date", ""))
-        
-        try:
-            h_proc_dt = pd.to_datetime(target_hotel.get("procurement_date"))
-            h_lead = (dep_dt.date() - h_proc_dt.date()).days
-        except Exception:
-            h_lead = 90
-            
-        try:
-            f_proc_dt = pd.to_datetime(target_flight.get("procurement_date"))
-            f_lead = (dep_dt.date() - f_proc_dt.date()).days
-        except Exception:
-            f_lead = 90
+        # グラフ用データの抽出（ndarray をそのまま Plotly に渡せる）
+        days_x = [f"D-{int(d)}" for d in hist["day_idx"]]
+        potential_waste_a = hist["potential_waste_a"]
+        potential_waste_b = hist["potential_waste_b"]
 
-        total_lead_days = max(h_lead, f_lead)
-        
-        v_today_dt = pd.to_datetime(v_today)
-            
-        # 過去時系列用配列の初期化
-        past_x = []
-        past_revenue = []
-        past_revenue_h = []
-        past_revenue_f = []
-        past_potential_waste = []
-        
-        # 過去イベントのフィルタリング（タイムゾーン影響を防ぐためDate型で比較）
-        v_today_date = v_today_dt.date()
-        
-        if not all_events.empty:
-            all_events["booked_date"] = pd.to_datetime(all_events["booked_at"]).dt.date
-            past_events_h = all_events[(all_events["inventory_id"] == target_hotel["id"]) & (all_events["booked_date"] <= v_today_date)]
-            past_events_f = all_events[(all_events["inventory_id"] == target_flight["id"]) & (all_events["booked_date"] <= v_today_date)]
-        else:
-            past_events_h = pd.DataFrame()
-            past_events_f = pd.DataFrame()
-        
-        # 初期状態
-        total_initial_cost = (target_hotel["total_stock"] * target_hotel["base_price"] * 0.9) + (target_flight["total_stock"] * target_flight["base_price"] * 0.9)
-        cum_rev = 0
-        cum_rev_h = 0
-        cum_rev_f = 0
-        current_h_stk = target_hotel["total_stock"]
-        current_f_stk = target_flight["total_stock"]
-
-        # 日次で集計ループ
-        # d は 出発日までの残り日数 (total_lead_days -> lead_days)
-        # つまり、古い日付から現在に向かって進むループにする必要がある
-        
-        # タイムゾーン等の影響を排除するため、イベント側の日付をDate型または文字列(YYYY-MM-DD)に前処理しておく
-        if not past_events_h.empty:
-            past_events_h = past_events_h.copy()
-            past_events_h["booked_date_str"] = pd.to_datetime(past_events_h["booked_at"]).dt.strftime("%Y-%m-%d")
-        if not past_events_f.empty:
-            past_events_f = past_events_f.copy()
-            past_events_f["booked_date_str"] = pd.to_datetime(past_events_f["booked_at"]).dt.strftime("%Y-%m-%d")
-
-        for d in range(total_lead_days, lead_days, -1):
-            current_date_dt = dep_dt - timedelta(days=d)
-            current_date_str = current_date_dt.strftime("%Y-%m-%d")
-            past_x.append(f"D-{d}")
-            
-            # ホテルの集計 (販売開始日以降のみ記録)
-            if d <= h_lead:
-                if not past_events_h.empty:
-                    day_sales_h = past_events_h[past_events_h["booked_date_str"] == current_date_str]
-                    sales_val_h = day_sales_h["sold_price"].sum()
-                    cum_rev += sales_val_h
-                    cum_rev_h += sales_val_h
-                    current_h_stk -= day_sales_h["quantity"].sum()
-                past_revenue_h.append(cum_rev_h)
-            else:
-                past_revenue_h.append(None)
-                
-            # フライトの集計 (販売開始日以降のみ記録)
-            if d <= f_lead:
-                if not past_events_f.empty:
-                    day_sales_f = past_events_f[past_events_f["booked_date_str"] == current_date_str]
-                    sales_val_f = day_sales_f["sold_price"].sum()
-                    cum_rev += sales_val_f
-                    cum_rev_f += sales_val_f
-                    current_f_stk -= day_sales_f["quantity"].sum()
-                past_revenue_f.append(cum_rev_f)
-            else:
-                past_revenue_f.append(None)
-                
-            # 全体合算と含み損
-            if d <= max(h_lead, f_lead):
-                past_revenue.append(cum_rev)
-                pw = (current_h_stk * target_hotel["base_price"] * 0.9) + (current_f_stk * target_flight["base_price"] * 0.9)
-                past_potential_waste.append(pw)
-            else:
-                past_revenue.append(None)
-                past_potential_waste.append(None)
+        # ─── 過去実績の集計 (販売開始日〜基準日) ───
+        # スライダー（割引額・負担割合）に依存しないためキャッシュ付きヘルパーで集計する
+        past = compute_past_actuals(
+            int(target_hotel["id"]), int(target_flight["id"]),
+            int(target_hotel["total_stock"]), int(target_flight["total_stock"]),
+            float(target_hotel["base_price"]), float(target_flight["base_price"]),
+            str(target_hotel.get("departure_date") or ""), str(target_flight.get("departure_date") or ""),
+            str(target_hotel.get("procurement_date") or ""), str(target_flight.get("procurement_date") or ""),
+            v_today, lead_days, len(all_events), _events=all_events,
+        )
+        past_x = past["past_x"]
+        past_revenue = past["past_revenue"]
+        past_revenue_h = past["past_revenue_h"]
+        past_revenue_f = past["past_revenue_f"]
+        past_potential_waste = past["past_potential_waste"]
+        total_initial_cost = past["total_initial_cost"]
 
         # ─── スライスされた履歴データと合体 ───
         def get_last_valid(lst):
@@ -1124,272 +1666,175 @@ if selected_tab == "🧪 Custom Simulator":
         offset_rev_h = get_last_valid(past_revenue_h)
         offset_rev_f = get_last_valid(past_revenue_f)
 
-        scenario_a_revenue = [r + offset_rev for r in [h["revenue_a"] for h in history]]
-        scenario_b_revenue = [r + offset_rev for r in [h["revenue_b"] for h in history]]
-        scenario_n_revenue = [r + offset_rev for r in [h["revenue_n"] for h in history]]
-        
-        scenario_a_rev_h = [r + offset_rev_h for r in [h["revenue_a_h"] for h in history]]
-        scenario_a_rev_f = [r + offset_rev_f for r in [h["revenue_a_f"] for h in history]]
-        scenario_b_rev_h = [r + offset_rev_h for r in [h["revenue_b_h"] for h in history]]
-        scenario_b_rev_f = [r + offset_rev_f for r in [h["revenue_b_f"] for h in history]]
-        scenario_n_rev_h = [r + offset_rev_h for r in [h["revenue_n_h"] for h in history]]
-        scenario_n_rev_f = [r + offset_rev_f for r in [h["revenue_n_f"] for h in history]]
-        
-        # 過去から未来へ線をはみ出さずシームレスに繋ぐためのブリッジ処理
-        # full_x の生成の際、重複を防ぐため調整
-        if past_x:
-            days_x_bridged = [past_x[-1]] + days_x
-            scenario_a_revenue = [get_last_valid(past_revenue)] + scenario_a_revenue
-            scenario_b_revenue = [get_last_valid(past_revenue)] + scenario_b_revenue
-            scenario_n_revenue = [get_last_valid(past_revenue)] + scenario_n_revenue
-            
-            scenario_a_rev_h = [get_last_valid(past_revenue_h)] + scenario_a_rev_h
-            scenario_a_rev_f = [get_last_valid(past_revenue_f)] + scenario_a_rev_f
-            scenario_b_rev_h = [get_last_valid(past_revenue_h)] + scenario_b_rev_h
-            scenario_b_rev_f = [get_last_valid(past_revenue_f)] + scenario_b_rev_f
-            scenario_n_rev_h = [get_last_valid(past_revenue_h)] + scenario_n_rev_h
-            scenario_n_rev_f = [get_last_valid(past_revenue_f)] + scenario_n_rev_f
-            
-            potential_waste_a = [get_last_valid(past_potential_waste)] + potential_waste_a
-            potential_waste_b = [get_last_valid(past_potential_waste)] + potential_waste_b
-        else:
-            days_x_bridged = days_x
-        
-        full_x = past_x + days_x
-        full_rev_a = past_revenue + scenario_a_revenue[1:] if past_x else scenario_a_revenue
-        full_rev_b = past_revenue + scenario_b_revenue[1:] if past_x else scenario_b_revenue
-        
-        full_rev_a_h = past_revenue_h + scenario_a_rev_h
-        full_rev_a_f = past_revenue_f + scenario_a_rev_f
-        full_rev_b_h = past_revenue_h + scenario_b_rev_h
-        full_rev_b_f = past_revenue_f + scenario_b_rev_f
-
-        full_waste_a = past_potential_waste + potential_waste_a
-        full_waste_b = past_potential_waste + potential_waste_b
-        
-        # 総仕入原価ライン（固定）
-        total_costs_line = [total_initial_cost] * len(full_x)
-
         # KPI用数値の抽出
-        final_revenue_a = full_rev_a[-1]
-        final_revenue_b = full_rev_b[-1]
-        final_waste_a = full_waste_a[-1]
-        final_waste_b = full_waste_b[-1]
-        
+        # （累積系列の末尾 = 最終値なので、結合系列を作る前に O(1) で求まる）
+        final_revenue_a = (hist["revenue_a"][-1] + offset_rev) if n_hist else offset_rev
+        final_revenue_b = (hist["revenue_b"][-1] + offset_rev) if n_hist else offset_rev
+        final_waste_a = hist["potential_waste_a"][-1] if n_hist else get_last_valid(past_potential_waste)
+        final_waste_b = hist["potential_waste_b"][-1] if n_hist else get_last_valid(past_potential_waste)
+
         # 利益指標の再計算 (最終着地利益 = 全体最終売上 - 全体総仕入原価 - 機会損失)
-        res_a = final_revenue_a - total_initial_cost
-        res_b = final_revenue_b - total_initial_cost - sim_res["details_b"].get("discount_loss", 0) - sim_res["details_b"].get("cannibal_loss", 0)
+        # 円単位の KPI はここで一度だけ int 化し、カード側の f-string では casts しない。
+        # figure キャッシュにヒットする rerun でも KPI カード・P/L 表は毎回描画する
+        # ため、これらの代入はキャッシュ分岐の外に置くこと（sim_res からの O(1) 読み）
+        res_a = int(final_revenue_a - total_initial_cost)
+        res_b = int(final_revenue_b - total_initial_cost - sim_res["details_b"].get("discount_loss", 0) - sim_res["details_b"].get("cannibal_loss", 0))
 
         total_sold_b_pkg = sim_res["packages_sold"]
-        curr_b_h_stock = history[-1]["h_stock_b"] if history else h_stock
-        flight_stock_b = history[-1]["f_stock_b"] if history else f_stock
-        
-        # 単品販売数の逆算
-        total_sold_a = int(target_hotel["remaining_stock"] - curr_b_h_stock)
-        total_sold_b_h_solo = max(0, int(target_hotel["remaining_stock"] - total_sold_b_pkg - curr_b_h_stock))
-        total_sold_b_f_solo = max(0, int(target_flight["remaining_stock"] - total_sold_b_pkg - flight_stock_b))
-        
-        # 単品シナリオの在庫残
-        # 簡易的に計算
-        curr_a_h_stock = target_hotel["remaining_stock"] - total_sold_a
-        flight_stock_a = target_flight["remaining_stock"] - total_sold_a
-        
+
+        # 在庫残・販売数はエンジンが返す最終状態をそのまま読む（逆算しない）
+        fin = sim_res["final_state"]
+        curr_b_h_stock = fin["h_stock_b"]
+        flight_stock_b = fin["f_stock_b"]
+        total_sold_a = fin["sold_h_a"]
+        total_sold_b_h_solo = fin["sold_h_solo_b"]
+        total_sold_b_f_solo = fin["sold_f_solo_b"]
+        curr_a_h_stock = fin["h_stock_a"]
+        flight_stock_a = fin["f_stock_a"]
+
         # 旧変数との互換性
         vel_b_boosted = 2.5 * (1.0 + (total_discount / 10000.0))
         h_cost = h_item_sim["cost"]
         f_cost = f_item_sim["cost"]
 
-        # --- 3. 視覚化 (Plotly) ---
-        from plotly.subplots import make_subplots
-        fig_sim = make_subplots(specs=[[{"secondary_y": True}]])
-
-        # 総仕入原価（水平線）
-        fig_sim.add_trace(go.Scatter(
-            x=full_x, y=total_costs_line, name="総仕入原価 (損益分岐点)",
-            line=dict(color='rgba(255,255,255,0.7)', width=2, dash='dash')
-        ), secondary_y=False)
-
-        # ─── 過去実績部分 ───
-        if past_x:
-            # 実績 ホテル単体
-            fig_sim.add_trace(go.Scatter(
-                x=past_x, y=past_revenue_h, name="🏨 累積売上実績 (ホテル)",
-                line=dict(color='rgba(96, 165, 250, 0.6)', width=2) # blue-400
-            ), secondary_y=False)
-            # 実績 フライト単体
-            fig_sim.add_trace(go.Scatter(
-                x=past_x, y=past_revenue_f, name="✈️ 累積売上実績 (フライト)",
-                line=dict(color='rgba(192, 132, 252, 0.6)', width=2) # purple-400
-            ), secondary_y=False)
-            # 実績 全体合算
-            fig_sim.add_trace(go.Scatter(
-                x=past_x, y=past_revenue, name="💰 累積売上実績 (全体合算)",
-                line=dict(color='#cbd5e1', width=3)
-            ), secondary_y=False)
-            
-            # 実績 含み損
-            fig_sim.add_trace(go.Scatter(
-                x=past_x, y=past_potential_waste, name="含み廃棄損リスク (実績)",
-                line=dict(color='#94a3b8', width=2, dash='dot')
-            ), secondary_y=True)
-
-        # ─── 未来予測部分 (シナリオN: ナイーブ・現状推移) ───
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_n_rev_h, name="🏨 予測売上 (現状推移・ホテル)",
-            line=dict(color='rgba(148, 163, 184, 0.4)', width=2, dash='dot') # slate-400
-        ), secondary_y=False)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_n_rev_f, name="✈️ 予測売上 (現状推移・フライト)",
-            line=dict(color='rgba(148, 163, 184, 0.4)', width=2, dash='dot') # slate-400
-        ), secondary_y=False)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_n_revenue, name="💰 予測売上 全体 (現状推移)",
-            line=dict(color='rgba(148, 163, 184, 0.6)', width=2, dash='dash')
-        ), secondary_y=False)
-
-        # ─── 未来予測部分 (シナリオA: 単体維持) ───
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_a_rev_h, name="🏨 予測売上 (ホテル・シナリオA)",
-            line=dict(color='rgba(248, 113, 113, 0.4)', width=2, dash='dot') # red-400
-        ), secondary_y=False)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_a_rev_f, name="✈️ 予測売上 (フライト・シナリオA)",
-            line=dict(color='rgba(251, 146, 60, 0.4)', width=2, dash='dot') # orange-400
-        ), secondary_y=False)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_a_revenue, name="💰 予測売上 全体 (シナリオA)",
-            line=dict(color='#f87171', width=3, dash='dot')
-        ), secondary_y=False)
-
-        # ─── 未来予測部分 (シナリオB: ハイブリッド) ───
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_b_rev_h, name="🏨 予測売上 (ホテル・シナリオB)",
-            line=dict(color='rgba(52, 211, 153, 0.6)', width=2) # emerald-400
-        ), secondary_y=False)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_b_rev_f, name="✈️ 予測売上 (フライト・シナリオB)",
-            line=dict(color='rgba(45, 212, 191, 0.6)', width=2) # teal-400
-        ), secondary_y=False)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=scenario_b_revenue, name="💰 予測売上 全体 (シナリオB)",
-            line=dict(color='#4ade80', width=4)
-        ), secondary_y=False)
-
-        # 含み廃棄損 (未来予測 B)
-        fig_sim.add_trace(go.Scatter(
-            x=days_x_bridged, y=potential_waste_b, name="予測含み廃棄損 (シナリオB)",
-            fill='tozeroy', fillcolor='rgba(74,222,128,0.1)',
-            line=dict(color='#4ade80', width=2, dash='dot')
-        ), secondary_y=True)
-
-        # 基準日（V-Line）
-        if past_x:
-            fig_sim.add_vline(x=past_x[-1], line_width=2, line_dash="dash", line_color="#a78bfa")
-            fig_sim.add_annotation(
-                x=past_x[-1], y=1.0, yref="paper",
-                text="本日 (実績/予測 境界)",
-                showarrow=False,
-                font=dict(color="#a78bfa", size=10),
-                xanchor="right", yanchor="bottom"
-            )
-
-        # ─── その他の補助線（マイルストーン） ───
-        # 例：D-30 (パッケージ用キャンセル無料終了の目安)
-        d30_label = "D-30"
-        if d30_label in full_x:
-            fig_sim.add_vline(x=d30_label, line_width=1, line_dash="dot", line_color="rgba(148, 163, 184, 0.5)")
-            fig_sim.add_annotation(
-                x=d30_label, y=0.05, yref="paper",
-                text="D-30",
-                showarrow=False,
-                font=dict(color="rgba(148, 163, 184, 0.8)", size=10),
-                xanchor="left", yanchor="bottom"
-            )
-            
-        # 例：D-14 (単品航空券需要ピークなど)
-        d14_label = "D-14"
-        if d14_label in full_x:
-            fig_sim.add_vline(x=d14_label, line_width=1, line_dash="dot", line_color="rgba(148, 163, 184, 0.5)")
-            fig_sim.add_annotation(
-                x=d14_label, y=0.05, yref="paper",
-                text="D-14",
-                showarrow=False,
-                font=dict(color="rgba(148, 163, 184, 0.8)", size=10),
-                xanchor="left", yanchor="bottom"
-            )
+        # 入力シグネチャが前回 rerun と同一なら、系列の結合〜figure 生成を丸ごと
+        # スキップして前回の figure を使い回す（split_ratio のみの変更などが該当）
+        fig_key = (
+            int(target_hotel["id"]), int(target_flight["id"]),
+            int(total_discount), lead_days, market_condition, v_today, len(all_events),
+        )
+        _fig_cached = st.session_state.get("sim_fig_cache")
+        if _fig_cached is not None and _fig_cached["sig"] == fig_key:
+            fig_sim = _fig_cached["fig"]
+        else:
+            # SoA の ndarray 列にオフセットをブロードキャスト加算（要素ごとの Python ループ不要）
+            scenario_a_revenue = hist["revenue_a"] + offset_rev
+            scenario_b_revenue = hist["revenue_b"] + offset_rev
+            scenario_n_revenue = hist["revenue_n"] + offset_rev
+
+            scenario_a_rev_h = hist["revenue_a_h"] + offset_rev_h
+            scenario_a_rev_f = hist["revenue_a_f"] + offset_rev_f
+            scenario_b_rev_h = hist["revenue_b_h"] + offset_rev_h
+            scenario_b_rev_f = hist["revenue_b_f"] + offset_rev_f
+            scenario_n_rev_h = hist["revenue_n_h"] + offset_rev_h
+            scenario_n_rev_f = hist["revenue_n_f"] + offset_rev_f
+
+            # 過去から未来へ線をはみ出さずシームレスに繋ぐためのブリッジ処理
+            # full_x の生成の際、重複を防ぐため調整
+            if past_x:
+                days_x_bridged = [past_x[-1]] + days_x
+                bridge_rev = get_last_valid(past_revenue)
+                bridge_rev_h = get_last_valid(past_revenue_h)
+                bridge_rev_f = get_last_valid(past_revenue_f)
+                bridge_waste = get_last_valid(past_potential_waste)
+                scenario_a_revenue = np.concatenate(([bridge_rev], scenario_a_revenue))
+                scenario_b_revenue = np.concatenate(([bridge_rev], scenario_b_revenue))
+                scenario_n_revenue = np.concatenate(([bridge_rev], scenario_n_revenue))
+
+                scenario_a_rev_h = np.concatenate(([bridge_rev_h], scenario_a_rev_h))
+                scenario_a_rev_f = np.concatenate(([bridge_rev_f], scenario_a_rev_f))
+                scenario_b_rev_h = np.concatenate(([bridge_rev_h], scenario_b_rev_h))
+                scenario_b_rev_f = np.concatenate(([bridge_rev_f], scenario_b_rev_f))
+                scenario_n_rev_h = np.concatenate(([bridge_rev_h], scenario_n_rev_h))
+                scenario_n_rev_f = np.concatenate(([bridge_rev_f], scenario_n_rev_f))
+
+                potential_waste_a = np.concatenate(([bridge_waste], potential_waste_a))
+                potential_waste_b = np.concatenate(([bridge_waste], potential_waste_b))
+            else:
+                days_x_bridged = days_x
+
+            full_x = past_x + days_x
+            full_rev_a = past_revenue + scenario_a_revenue[1:].tolist() if past_x else scenario_a_revenue.tolist()
+            full_rev_b = past_revenue + scenario_b_revenue[1:].tolist() if past_x else scenario_b_revenue.tolist()
+
+            full_rev_a_h = past_revenue_h + scenario_a_rev_h.tolist()
+            full_rev_a_f = past_revenue_f + scenario_a_rev_f.tolist()
+            full_rev_b_h = past_revenue_h + scenario_b_rev_h.tolist()
+            full_rev_b_f = past_revenue_f + scenario_b_rev_f.tolist()
+
+            full_waste_a = past_potential_waste + potential_waste_a.tolist()
+            full_waste_b = past_potential_waste + potential_waste_b.tolist()
+
+            # --- 3. 視覚化 (Plotly) ---
+            # 軸レンジは系列の最大値から決め、figure 本体はキャッシュ付きビルダーで構築する。
+            # 売上系列は累積値（単調非減少）なので、全要素スキャンせず末尾の値が最大値
+            max_y_candidates = [total_initial_cost]
+            if full_rev_a: max_y_candidates.append(final_revenue_a)
+            if full_rev_b: max_y_candidates.append(final_revenue_b)
+            if len(scenario_n_revenue): max_y_candidates.append(scenario_n_revenue[-1])
+            max_y = max(max_y_candidates) * 1.2
+
+            # 系列はタプル化（コピー）せず ndarray のまま渡し、キーはスカラーで代表する
+            fig_sim = go.Figure(build_sim_figure_dict(
+                fig_key, float(total_initial_cost), float(max_y),
+                _series={
+                    "past_x": past_x, "past_rev": past_revenue, "past_rev_h": past_revenue_h,
+                    "past_rev_f": past_revenue_f, "past_waste": past_potential_waste,
+                    "days_x_bridged": days_x_bridged,
+                    "n_rev_h": scenario_n_rev_h, "n_rev_f": scenario_n_rev_f, "n_rev": scenario_n_revenue,
+                    "a_rev_h": scenario_a_rev_h, "a_rev_f": scenario_a_rev_f, "a_rev": scenario_a_revenue,
+                    "b_rev_h": scenario_b_rev_h, "b_rev_f": scenario_b_rev_f, "b_rev": scenario_b_revenue,
+                    "waste_b": potential_waste_b, "full_x": full_x,
+                },
+            ))
+            st.session_state["sim_fig_cache"] = {"sig": fig_key, "fig": fig_sim}
+        st.plotly_chart(fig_sim, use_container_width=True, key="sim_timeseries_chart")
 
-        # レイアウト調整
-        dark_layout(fig_sim, secondary_y=True)
-        fig_sim.update_layout(
-            title="P/L 予測シミュレーション（実績＋将来予測）",
-            xaxis=dict(
-                title="タイムライン（右端 = 期限・出発日 D-0）",
-                gridcolor="#1e293b",
-                dtick=10 if len(full_x) > 30 else 5
-            ),
-            hovermode="x unified",
-            height=500
+        # 割引候補の一括スイープから最適割引をレコメンド（結果はキャッシュされる）
+        best_disc, best_gain = cached_discount_sweep(
+            tuple(sorted(h_item_sim.items())), tuple(sorted(f_item_sim.items())),
+            lead_days, market_condition, ref=v_today
         )
-        # 左右の軸個別設定
-        max_y_candidates = [total_initial_cost]
-        if full_rev_a: max_y_candidates.append(max(full_rev_a))
-        if full_rev_b: max_y_candidates.append(max(full_rev_b))
-        if scenario_n_revenue: max_y_candidates.append(max(scenario_n_revenue))
-        max_y = max(max_y_candidates) * 1.2
-        
-        fig_sim.update_yaxes(title_text="累積金額 (円)", secondary_y=False, range=[0, max_y], gridcolor="#1e293b", tickformat=",d")
-        fig_sim.update_yaxes(title_text="含み廃棄損 (円)", secondary_y=True, range=[0, max_y], gridcolor="rgba(0,0,0,0)", showticklabels=False, tickformat=",d")
+        if best_gain is not None:
+            st.caption(f"💡 AI推奨割引額: **¥{best_disc:,}**（割引候補 0〜20,000円 を一括評価。このとき利益差分が最大 ¥{best_gain:,} と試算）")
 
-        st.plotly_chart(fig_sim, use_container_width=True, key="sim_timeseries_chart")
-        
         # --- 4. 決着 KPI ---
         # 利益指標は上で再計算された res_a, res_b を利用するため不要な代入を削除
         diff = res_b - res_a
         
         st.markdown("#### 🏁 予測結果・着地点比較（Day 0 廃棄損計上済み）")
-        ck1, ck2, ck3 = st.columns(3)
-        with ck1:
-            st.markdown(f"""
-            <div style='background:rgba(248,113,113,0.1); border:1px solid #f87171; border-radius:12px; padding:15px; text-align:center;'>
-                <div style='font-size:0.8rem; color:#f87171;'>① 単品で粘る場合の着地点</div>
-                <div style='font-size:1.5rem; font-weight:800;'>¥{int(res_a):,}</div>
-                <div style='font-size:0.8rem; margin-top:10px;'>🏨 販売: {int(total_sold_a)}室 / 売れ残り: {int(curr_a_h_stock)}室</div>
-                <div style='font-size:0.8rem;'>✈️ 販売: {int(f_stock - flight_stock_a)}席 / 売れ残り: {int(flight_stock_a)}席</div>
-            </div>
-            """, unsafe_allow_html=True)
-        with ck2:
-            h_sold_b_total = int(total_sold_b_pkg + total_sold_b_h_solo)
-            f_sold_b_total = int(total_sold_b_pkg + total_sold_b_f_solo)
-            h_unsold_b = int(curr_b_h_stock)
-            f_unsold_b = int(flight_stock_b)
-            st.markdown(f"""
-            <div style='background:rgba(74,222,128,0.1); border:1px solid #4ade80; border-radius:12px; padding:15px; text-align:center;'>
-                <div style='font-size:0.8rem; color:#4ade80;'>② ハイブリッド化の理想着地点</div>
-                <div style='font-size:1.5rem; font-weight:800;'>¥{int(res_b):,}</div>
-                <div style='font-size:0.75rem; color:#4ade80; margin-top:8px;'>📦 パッケージ: {int(total_sold_b_pkg)}組</div>
-                <div style='font-size:0.8rem; margin-top:4px;'>🏨 販売: {h_sold_b_total}室（単品切替{int(total_sold_b_h_solo)}室）/ 売れ残り: {h_unsold_b}室</div>
-                <div style='font-size:0.8rem;'>✈️ 販売: {f_sold_b_total}席（単品切替{int(total_sold_b_f_solo)}席）/ 売れ残り: {f_unsold_b}席</div>
-            </div>
-            """, unsafe_allow_html=True)
-        with ck3:
-            st.markdown(f"""
-            <div style='background:rgba(167,139,250,0.2); border:1px solid #a78bfa; border-radius:12px; padding:15px; text-align:center; box-shadow: 0 0 15px rgba(167,139,250,0.3);'>
-                <div style='font-size:0.8rem; color:#a78bfa;'>トータル収益改善の見込み</div>
-                <div style='font-size:1.5rem; font-weight:900;'>+¥{int(diff):,}</div>
-                <div style='font-size:0.8rem; margin-top:10px;'>（リスク回避後の純増利益）</div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-        st.markdown(f"""
-        <div style='background:rgba(30,27,75,0.4); border:1px solid rgba(167,139,250,0.4); border-radius:10px; padding:15px; margin-top:20px; margin-bottom:20px;'>
-            <h5 style='margin-top:0;'>💡 AI 戦略アドバイス</h5>
-            <p style='font-size:0.9rem; color:#e2e8f0;'>
-                シナリオAでは <b>{int(curr_a_h_stock)}個</b> の売れ残りが発生し、仕入原価 <b>¥{int(curr_a_h_stock * h_cost):,}</b> が丸損となる予測です。<br>
-                パッケージ化（シナリオB）では販売速度を <b>{vel_b_boosted:.1f}件/日</b> まで引き上げることで、売れ残り数を <b>{int(curr_b_h_stock)}個</b> まで圧縮します。
-                フライトのカニバリゼーションを考慮しても、この在庫リスク回避が <b>¥{int(diff):,}</b> の利益貢献につながります。
-            </p>
+        # KPI 3 カードも flex コンテナでまとめて 1 回の markdown 書き込みにする
+        h_sold_b_total = total_sold_b_pkg + total_sold_b_h_solo
+        f_sold_b_total = total_sold_b_pkg + total_sold_b_f_solo
+        h_unsold_b = curr_b_h_stock
+        f_unsold_b = flight_stock_b
+        kpi_card1 = f"""
+        <div style='flex:1; background:rgba(248,113,113,0.1); border:1px solid #f87171; border-radius:12px; padding:15px; text-align:center;'>
+            <div style='font-size:0.8rem; color:#f87171;'>① 単品で粘る場合の着地点</div>
+            <div style='font-size:1.5rem; font-weight:800;'>¥{res_a:,}</div>
+            <div style='font-size:0.8rem; margin-top:10px;'>🏨 販売: {total_sold_a}室 / 売れ残り: {curr_a_h_stock}室</div>
+            <div style='font-size:0.8rem;'>✈️ 販売: {f_stock - flight_stock_a}席 / 売れ残り: {flight_stock_a}席</div>
         </div>
-        """, unsafe_allow_html=True)
+        """
+        kpi_card2 = f"""
+        <div style='flex:1; background:rgba(74,222,128,0.1); border:1px solid #4ade80; border-radius:12px; padding:15px; text-align:center;'>
+            <div style='font-size:0.8rem; color:#4ade80;'>② ハイブリッド化の理想着地点</div>
+            <div style='font-size:1.5rem; font-weight:800;'>¥{res_b:,}</div>
+            <div style='font-size:0.75rem; color:#4ade80; margin-top:8px;'>📦 パッケージ: {total_sold_b_pkg}組</div>
+            <div style='font-size:0.8rem; margin-top:4px;'>🏨 販売: {h_sold_b_total}室（単品切替{total_sold_b_h_solo}室）/ 売れ残り: {h_unsold_b}室</div>
+            <div style='font-size:0.8rem;'>✈️ 販売: {f_sold_b_total}席（単品切替{total_sold_b_f_solo}席）/ 売れ残り: {f_unsold_b}席</div>
+        </div>
+        """
+        kpi_card3 = f"""
+        <div style='flex:1; background:rgba(167,139,250,0.2); border:1px solid #a78bfa; border-radius:12px; padding:15px; text-align:center; box-shadow: 0 0 15px rgba(167,139,250,0.3);'>
+            <div style='font-size:0.8rem; color:#a78bfa;'>トータル収益改善の見込み</div>
+            <div style='font-size:1.5rem; font-weight:900;'>+¥{diff:,}</div>
+            <div style='font-size:0.8rem; margin-top:10px;'>（リスク回避後の純増利益）</div>
+        </div>
+        """
+        st.markdown(
+            "<div style='display:flex; gap:12px; align-items:stretch;'>"
+            + kpi_card1 + kpi_card2 + kpi_card3 + "</div>",
+            unsafe_allow_html=True,
+        )
+        
+        st.markdown(_ADVICE_TMPL.substitute(
+            unsold_a=curr_a_h_stock,
+            unsold_cost=f"{curr_a_h_stock * h_cost:,}",
+            vel_boost=f"{vel_b_boosted:.1f}",
+            unsold_b=curr_b_h_stock,
+            diff=f"{diff:,}",
+        ), unsafe_allow_html=True)
         
         # --- 5. P/L マトリクスと詳細明細表 ---
         st.markdown("#### 📊 シミュレーション詳細明細")
@@ -1412,7 +1857,7 @@ if selected_tab == "🧪 Custom Simulator":
                 {"項目": "② 総仕入原価 (固定)", "シナリオA": f"-¥{int(total_initial_cost):,}", "シナリオB": f"-¥{int(total_initial_cost):,}", "差分 (B - A)": "¥0"},
                 {"項目": "③ 内、廃棄損 (売れ残り分)", "シナリオA": f"(-¥{int(final_waste_a):,})", "シナリオB": f"(-¥{int(final_waste_b):,})", "差分 (B - A)": f"¥{int(final_waste_a - final_waste_b):,} (ロス回避)"},
                 {"項目": "④ 各種割引・逸失利益等", "シナリオA": "¥0", "シナリオB": f"-¥{int(sim_res['details_b'].get('discount_loss', 0) + sim_res['details_b'].get('cannibal_loss', 0)):,}", "差分 (B - A)": f"-¥{int(sim_res['details_b'].get('discount_loss', 0) + sim_res['details_b'].get('cannibal_loss', 0)):,}"},
-                {"項目": "⭐ 最終着地利益", "シナリオA": f"¥{int(res_a):,}", "シナリオB": f"¥{int(res_b):,}", "差分 (B - A)": f"¥{int(res_b - res_a):,}"},
+                {"項目": "⭐ 最終着地利益", "シナリオA": f"¥{res_a:,}", "シナリオB": f"¥{res_b:,}", "差分 (B - A)": f"¥{int(res_b - res_a):,}"},
             ]
             st.dataframe(pd.DataFrame(pl_data), use_container_width=True, hide_index=True)
 
@@ -8,41 +8,61 @@ import streamlit as st
 import sqlite3
 import os
 from datetime import datetime, timezone
+from functools import lru_cache
 
-def log_price_history(results: list[dict], db_path: str):
-    """現在の動的価格を履歴テーブルに保存する（トレンド可視化用）"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def log_price_history(results: list[dict], conn: sqlite3.Connection):
+    """現在の動的価格を履歴テーブルに保存する（トレンド可視化用）
+
+    接続は呼び出し側が管理する共有のものを受け取る（毎回 connect/close しない）。
+    """
+    if not results:
+        return
     now_str = datetime.now(timezone.utc).isoformat()
-    for r in results:
-        # inv_ratio * 100 を整数として保存（旧仕様準拠）
-        cursor.execute("""
-            INSERT INTO price_history (inventory_id, recorded_at, remaining_stock, dynamic_price, lead_days)
-            VALUES (?, ?, ?, ?, ?)
-        """, (r["inventory_id"], now_str, int(r.get("inv_ratio", 0)*100), r["final_price"], r["lead_days"]))
+    # inv_ratio * 100 を整数として保存（旧仕様準拠）
+    rows = [
+        (r["inventory_id"], now_str, int(r.get("inv_ratio", 0)*100), r["final_price"], r["lead_days"])
+        for r in results
+    ]
+    # N 回の execute/commit ではなく 1 トランザクションにまとめて fsync を 1 回にする
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("""
+        INSERT INTO price_history (inventory_id, recorded_at, remaining_stock, dynamic_price, lead_days)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
     conn.commit()
-    conn.close()
 
+@lru_cache(maxsize=64)
 def hex_to_rgba(hex_color: str, opacity: float) -> str:
-    """HexカラーをRGBA文字列に変換する"""
+    """HexカラーをRGBA文字列に変換する（同じ色+透過度の再パースはキャッシュで回避）"""
     hex_color = hex_color.lstrip('#')
     lv = len(hex_color)
     rgb = tuple(int(hex_color[i:i + lv // 3], 16) for i in range(0, lv, lv // 3))
     return f'rgba({rgb[0]}, {rgb[1]}, {rgb[2]}, {opacity})'
 
+# 全チャート共通の静的レイアウト。図ごとに dict リテラルを組み直さず、
+# モジュールロード時に一度だけ構築して使い回す。
+_BASE_LAYOUT = dict(
+    paper_bgcolor="rgba(0,0,0,0)",
+    plot_bgcolor="rgba(0,0,0,0)",
+    template="plotly_dark",
+    margin=dict(l=20, r=20, t=50, b=40),
+    font=dict(family="Outfit, sans-serif", color="#e2e8f0"),
+    xaxis=dict(gridcolor="#1e293b", linecolor="#334155"),
+    yaxis=dict(gridcolor="#1e293b", linecolor="#334155"),
+    legend=dict(bgcolor="rgba(0,0,0,0)", bordercolor="#334155"),
+    # closest / x unified はポイント密度が高いとホバー計算が重くなるため
+    # 軽量な "x" に固定する
+    hovermode="x",
+    # 同一データの再描画時にクライアント側のズーム/凡例状態とレイアウト
+    # アニメーションを維持する（無関係な rerun でのチャート再構築を抑制）
+    uirevision="fixed",
+)
+
 def dark_layout(fig: go.Figure, title: str = "", secondary_y: bool = False, yaxis_title: str = "") -> go.Figure:
     """PlotlyのFigureにダークテーマの共通レイアウトを適用する"""
-    fig.update_layout(
-        title=title,
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        template="plotly_dark",
-        margin=dict(l=20, r=20, t=50, b=40),
-        font=dict(family="Outfit, sans-serif", color="#e2e8f0"),
-        xaxis=dict(gridcolor="#1e293b", linecolor="#334155"),
-        yaxis=dict(gridcolor="#1e293b", linecolor="#334155", title=yaxis_title),
-        legend=dict(bgcolor="rgba(0,0,0,0)", bordercolor="#334155")
-    )
+    fig.update_layout(title=title, **_BASE_LAYOUT)
+    if yaxis_title:
+        fig.update_yaxes(title=yaxis_title)
     if secondary_y:
         fig.update_layout(yaxis2=dict(gridcolor="#1e293b", linecolor="#334155"))
     return fig
@@ -61,9 +81,8 @@ def render_metric_card(label: str, value: str, subvalue: str = "", delta: str =
       {brake_html}
     </div>""", unsafe_allow_html=True)
 
-def apply_custom_css():
-    """カスタムCSSを適用する"""
-    st.markdown("""
+# CSS は静的な文字列なので rerun ごとに組み立て直さずモジュール定数で持つ
+_CUSTOM_CSS = """
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Outfit:wght@300;400;600;900&family=Inter:wght@400;700&display=swap');
     
@@ -188,10 +207,14 @@ def apply_custom_css():
     .alert-info { background: rgba(96,165,250,0.1); border: 1px solid rgba(96,165,250,0.4); color: #60a5fa; }
     .alert-icon { font-size: 1.2rem; }
     </style>
-    """, unsafe_allow_html=True)
+    """
 
-def render_alerts(results, inv_df, packages, get_velocity_ratio_func):
-    """共通のアラート通知エリアを描画する"""
+def apply_custom_css():
+    """カスタムCSSを適用する"""
+    st.markdown(_CUSTOM_CSS, unsafe_allow_html=True)
+
+def compute_alerts(results, inv_df, packages, get_velocity_ratio_func) -> list[tuple]:
+    """アラート一覧 (level, icon, msg) を計算する（描画はしない）"""
     alerts = []
     
     # 1. 自動ブレーキ発動中の商品
@@ -200,15 +223,19 @@ def render_alerts(results, inv_df, packages, get_velocity_ratio_func):
         alerts.append(("danger", "🚔", f"<b>緊急ブレーキ発動中</b>: {b['name']} は売れすぎのため、AIが自動で値上げ調整を行っています。"))
     
     # 2. 売れ行き鈍化（在庫処分推奨）
+    # 結果ごとの boolean フィルタ (O(N^2)) を避け、id インデックスを一度だけ作る
+    inv_idx = inv_df.set_index("id", drop=False) if len(inv_df) else None
     for r in results:
-        inv_matches = inv_df[inv_df["id"] == r["inventory_id"]]
-        if inv_matches.empty: continue
-        inv = inv_matches.iloc[0]
+        if inv_idx is None or r["inventory_id"] not in inv_idx.index: continue
+        inv = inv_idx.loc[r["inventory_id"]]
+        # bare except は KeyboardInterrupt まで飲み込むため、データ起因の
+        # 例外だけに限定する
         try:
             vr = get_velocity_ratio_func(r["inventory_id"], int(inv["total_stock"]), int(inv["remaining_stock"]), r["lead_days"])
             if vr and vr < 0.5 and r["inv_ratio"] > 0.6:
                 alerts.append(("warning", "⚠️", f"<b>販売鈍化警告</b>: {r['name']} の消化が遅れています。パッケージ割引の強化を推奨します。"))
-        except: pass
+        except (KeyError, ValueError, TypeError):
+            pass
 
     # 3. 未救済の切迫在庫
     if packages:
@@ -216,11 +243,20 @@ def render_alerts(results, inv_df, packages, get_velocity_ratio_func):
         if top_pkg.get("strategy_score", 0) > 0.8:
             alerts.append(("info", "💡", f"<b>利益最大化のチャンス</b>: {top_pkg['hotel_name']} を含むパッケージが非常に高いスコアを記録しています。"))
 
+    return alerts
+
+def render_alerts_prebuilt(alerts: list[tuple]):
+    """計算済みアラート一覧を 1 回の markdown 呼び出しで描画する"""
     if alerts:
-        for level, icon, msg in alerts:
-            st.markdown(f"""
+        st.markdown("".join(
+            f"""
             <div class="alert-box alert-{level}">
                 <span class="alert-icon">{icon}</span>
                 <span>{msg}</span>
             </div>
-            """, unsafe_allow_html=True)
+            """ for level, icon, msg in alerts
+        ), unsafe_allow_html=True)
+
+def render_alerts(results, inv_df, packages, get_velocity_ratio_func):
+    """共通のアラート通知エリアを描画する"""
+    render_alerts_prebuilt(compute_alerts(results, inv_df, packages, get_velocity_ratio_func))
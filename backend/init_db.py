@@ -189,6 +189,12 @@ def init_db():
         )
     ''')
 
+    # ダッシュボードの inventory_id 絞り込みクエリ用インデックス
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ph_invid_time
+        ON price_history(inventory_id, recorded_at)
+    ''')
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS booking_events (
             id                 INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -1,6 +1,8 @@
 import sqlite3
+import numpy as np
 import pandas as pd
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from typing import Optional
 import os
 import math # 追加
 from constants import (
@@ -51,6 +53,50 @@ def get_velocity_ratio(inventory_id: int, total_stock: int, remaining_stock: int
         return None
     return actual_24h / expected_24h
 
+def get_velocity_ratio_batch(
+    inventory_ids,
+    total_stocks,
+    remaining_stocks,
+    lead_days_arr,
+    reference_date: Optional[date] = None,
+) -> np.ndarray:
+    """get_velocity_ratio の一括版。
+
+    商品ごとに 1 クエリ（N 往復）を発行する代わりに、booking_events への
+    `IN (...) GROUP BY inventory_id` 1 クエリで直近24時間の販売数をまとめて
+    取得し、期待ペースとの比率を ndarray で返す。比率を計算できない行
+    （期待ペース 0 や出発日未設定）はスカラー版の None に対応する NaN。
+    """
+    ids = [int(i) for i in inventory_ids]
+    if not ids:
+        return np.array([], dtype=np.float64)
+
+    if reference_date:
+        now = datetime.combine(reference_date, datetime.max.time()).replace(tzinfo=timezone.utc)
+    else:
+        now = datetime.now(timezone.utc)
+    one_day_ago = (now - timedelta(days=1)).isoformat()
+    now_str = now.isoformat()
+
+    conn = get_conn()
+    placeholders = ",".join("?" * len(ids))
+    rows = conn.execute(
+        f"""SELECT inventory_id, SUM(quantity) AS qty FROM booking_events
+            WHERE inventory_id IN ({placeholders}) AND booked_at >= ? AND booked_at <= ?
+            GROUP BY inventory_id""",
+        (*ids, one_day_ago, now_str)
+    ).fetchall()
+    conn.close()
+
+    qty_map = {r["inventory_id"]: (r["qty"] or 0) for r in rows}
+    actual = np.array([qty_map.get(i, 0) for i in ids], dtype=np.float64)
+    lead = np.array([np.nan if l is None else float(l) for l in lead_days_arr])
+    totals = np.asarray(total_stocks, dtype=np.float64)
+
+    expected = np.where(lead > 0, totals / np.maximum(lead, 1.0), 0.0)
+    with np.errstate(invalid="ignore"):
+        return np.where(expected > 0, actual / np.maximum(expected, 1e-12), np.nan)
+
 def hotel_urgency_score(remaining_stock: int, total_stock: int, lead_days: int) -> float:
     """ホテルの切迫度スコア (0.0 - 1.0)"""
     inv_ratio = remaining_stock / total_stock if total_stock > 0 else 0
@@ -226,6 +272,66 @@ def calculate_demand_forecast(inventory_id: int, lead_days: int, remaining_stock
         }
     return forecast_results
 
+def calculate_demand_forecast_batch(
+    inventory_ids: list[int],
+    lead_days: list[int],
+    remaining_stock: list[int],
+    total_stock: list[int],
+    base_price: list[int],
+    cost: list[int],
+    reference_date: Optional[date] = None,
+) -> pd.DataFrame:
+    """calculate_demand_forecast のバッチ版。
+
+    直近14日の販売実績を 1 クエリ (GROUP BY inventory_id) でまとめて取得し、
+    シナリオ別の着地点を NumPy のベクトル演算で一括計算する。
+    戻り値は inventory_id を index とし、シナリオごとに
+    daily_pace_* / predicted_sales_* / unsold_stock_* / expected_profit_*
+    列を持つ DataFrame。
+    """
+    if len(inventory_ids) == 0:
+        return pd.DataFrame()
+
+    conn = get_conn()
+    if reference_date:
+        now = datetime.combine(reference_date, datetime.max.time()).replace(tzinfo=timezone.utc)
+    else:
+        now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=14)).isoformat()
+    now_str = now.isoformat()
+
+    placeholders = ",".join("?" * len(inventory_ids))
+    rows = conn.execute(
+        f"""SELECT inventory_id, SUM(quantity) as qty FROM booking_events
+            WHERE inventory_id IN ({placeholders}) AND booked_at >= ? AND booked_at <= ?
+            GROUP BY inventory_id""",
+        (*inventory_ids, cutoff, now_str)
+    ).fetchall()
+    conn.close()
+    qty_map = {r["inventory_id"]: (r["qty"] or 0) for r in rows}
+
+    lead = np.asarray(lead_days, dtype=float)
+    remaining = np.asarray(remaining_stock, dtype=float)
+    total = np.asarray(total_stock, dtype=float)
+    base = np.asarray(base_price, dtype=float)
+    cost_arr = np.asarray(cost, dtype=float)
+
+    base_velocity = np.array([qty_map.get(i, 0) for i in inventory_ids], dtype=float) / 14.0
+    fallback = total * 0.7 / np.maximum(lead, 30)
+    base_velocity = np.where(base_velocity < 0.05, fallback, base_velocity)
+
+    out = pd.DataFrame(index=pd.Index(inventory_ids, name="inventory_id"))
+    for key, multiplier in FORECAST_MULTIPLIERS.items():
+        daily_pace = base_velocity * multiplier
+        predicted = np.minimum(remaining, daily_pace * np.maximum(0, lead))
+        unsold = remaining - predicted
+        net_profit = predicted * (base - cost_arr) - unsold * cost_arr
+        out[f"daily_pace_{key}"] = np.round(daily_pace, 2)
+        out[f"predicted_sales_{key}"] = np.round(predicted, 1)
+        out[f"unsold_stock_{key}"] = np.round(unsold, 1)
+        out[f"expected_profit_{key}"] = net_profit.astype(int)
+    return out
+
 def calculate_inventory_rescue_metrics(inventory_ids: Optional[list[int]] = None, reference_date: Optional[date] = None) -> dict:
     """切迫在庫の救済率を算出する"""
     conn = get_conn()
@@ -329,6 +435,8 @@ def simulate_sales_scenario(
     total_profit_a = 0
     total_profit_b = 0
     total_sold_pkg = 0
+    sold_h_solo_b = 0
+    sold_f_solo_b = 0
     
     revenue_a_h = 0
     cost_a_h = 0
@@ -346,15 +454,43 @@ def simulate_sales_scenario(
     revenue_n_h = 0
     revenue_n_f = 0
     
-    history = []
-
     days_t = list(range(max(1, lead_days), -1, -1))
-    
-    for t in days_t:
+
+    # 履歴記録 (グラフ用)
+    # per-day の dict リストではなく列ごとの ndarray (SoA) に記録する。
+    # スライダー操作のたびに全日数分の dict 生成・キー参照が走るのを避け、
+    # 派生列（合算売上等）はループ後に一括のベクトル演算で作る。
+    n_days = len(days_t)
+    hist = {
+        col: np.empty(n_days, dtype=np.float64)
+        for col in (
+            "day_idx", "profit_a", "profit_b",
+            "h_stock_a", "f_stock_a", "h_stock_b", "f_stock_b",
+            "revenue_n_h", "revenue_n_f", "revenue_a_h", "revenue_a_f",
+            "revenue_b_pkg", "revenue_b_h_solo", "revenue_b_f_solo",
+            "potential_waste_a", "potential_waste_b", "decay_factor",
+        )
+    }
+
+    # 減衰係数は在庫状態に依存しない「残り日数」だけの関数なので、
+    # 日次ループの外で一括計算しておく（ループ不変量の巻き上げ）
+    hist["decay_factor"][:] = [_get_decay_factor(t, lead_days) for t in days_t]
+
+    # 日次ループの不変量をローカルに巻き上げる。
+    # ループ本体は前日の在庫が当日に効く逐次漸化式のためベクトル化できないが、
+    # 毎日の dict キー参照・再計算を無くすだけで CPython でも大幅に軽くなる。
+    h_price = h_item["current_price"]
+    f_price = f_item["current_price"]
+    h_cost_unit = h_item["cost"]
+    f_cost_unit = f_item["cost"]
+    h_naive_price = h_item.get("original_price", h_price)
+    f_naive_price = f_item.get("original_price", f_price)
+    pkg_unit_profit = (h_unit_profit_standalone + f_unit_profit_standalone) - discount
+    pkg_price = h_price + f_price - discount
+    cannibal_unit = f_unit_profit_standalone * dynamic_cannibal_rate
+
+    for i, t in enumerate(days_t):
         # --- シナリオ N (ナイーブ・単体・現状維持) ---
-        h_naive_price = h_item.get("original_price", h_item["current_price"])
-        f_naive_price = f_item.get("original_price", f_item["current_price"])
-        
         sold_h_n = min(curr_n_h_stock, vel_a_base)
         curr_n_h_stock -= sold_h_n
         revenue_n_h += sold_h_n * h_naive_price
@@ -367,14 +503,14 @@ def simulate_sales_scenario(
         sold_h_a = min(curr_a_h_stock, vel_a_base)
         curr_a_h_stock -= sold_h_a
         total_profit_a += sold_h_a * h_unit_profit_standalone
-        revenue_a_h += sold_h_a * h_item["current_price"]
-        cost_a_h += sold_h_a * h_item["cost"]
+        revenue_a_h += sold_h_a * h_price
+        cost_a_h += sold_h_a * h_cost_unit
 
         sold_f_a = min(flight_stock_a, vel_b_base)
         flight_stock_a -= sold_f_a
         total_profit_a += sold_f_a * f_unit_profit_standalone
-        revenue_a_f += sold_f_a * f_item["current_price"]
-        cost_a_f += sold_f_a * f_item["cost"]
+        revenue_a_f += sold_f_a * f_price
+        cost_a_f += sold_f_a * f_cost_unit
 
         # --- シナリオ B (パッケージ + 切替) ---
         # パッケージ販売
@@ -383,64 +519,55 @@ def simulate_sales_scenario(
         total_sold_pkg += sold_pkg
         curr_b_h_stock -= sold_pkg
         flight_stock_b -= sold_pkg
-        
+
         # パッケージ利益
-        pkg_unit_profit = (h_unit_profit_standalone + f_unit_profit_standalone) - discount
-        total_profit_b += sold_pkg * pkg_unit_profit - (sold_pkg * f_unit_profit_standalone * dynamic_cannibal_rate)
-        
+        total_profit_b += sold_pkg * pkg_unit_profit - (sold_pkg * cannibal_unit)
+
         # パッケージ売上等
-        revenue_b_pkg += sold_pkg * (h_item["current_price"] + f_item["current_price"] - discount)
-        cost_b_h += sold_pkg * h_item["cost"]
-        cost_b_f += sold_pkg * f_item["cost"]
+        revenue_b_pkg += sold_pkg * pkg_price
+        cost_b_h += sold_pkg * h_cost_unit
+        cost_b_f += sold_pkg * f_cost_unit
         discount_b_total += sold_pkg * discount
-        cannibal_loss_b += sold_pkg * f_unit_profit_standalone * dynamic_cannibal_rate
+        cannibal_loss_b += sold_pkg * cannibal_unit
 
         # 在庫が偏った場合の単品切替
         if curr_b_h_stock > 0 and flight_stock_b == 0:
             sold_h_solo = min(curr_b_h_stock, vel_a_base)
             curr_b_h_stock -= sold_h_solo
+            sold_h_solo_b += sold_h_solo
             total_profit_b += sold_h_solo * h_unit_profit_standalone
-            revenue_b_h_solo += sold_h_solo * h_item["current_price"]
-            cost_b_h += sold_h_solo * h_item["cost"]
-            
+            revenue_b_h_solo += sold_h_solo * h_price
+            cost_b_h += sold_h_solo * h_cost_unit
+
         elif flight_stock_b > 0 and curr_b_h_stock == 0:
             sold_f_solo = min(flight_stock_b, vel_b_base)
             flight_stock_b -= sold_f_solo
+            sold_f_solo_b += sold_f_solo
             total_profit_b += sold_f_solo * f_unit_profit_standalone
-            revenue_b_f_solo += sold_f_solo * f_item["current_price"]
-            cost_b_f += sold_f_solo * f_item["cost"]
+            revenue_b_f_solo += sold_f_solo * f_price
+            cost_b_f += sold_f_solo * f_cost_unit
 
         # 日次の含み廃棄損 (まだ売れ残っている在庫の原価総額)
-        potential_waste_a = (curr_a_h_stock * h_item["cost"]) + (flight_stock_a * f_item["cost"])
-        potential_waste_b = (curr_b_h_stock * h_item["cost"]) + (flight_stock_b * f_item["cost"])
-
-        # 履歴記録 (グラフ用)
-        # ※ シナリオBの売上内訳について、パッケージ売上は目安として 1:1 (半額ずつ) 按分として記録します。
-        revenue_b_pkg_h_estimated = revenue_b_pkg // 2
-        revenue_b_pkg_f_estimated = revenue_b_pkg - revenue_b_pkg_h_estimated
-
-        history.append({
-            "day_idx": t,
-            "day_label": f"D-{t}",
-            "profit_a": int(total_profit_a),
-            "profit_b": int(total_profit_b),
-            "h_stock_a": int(curr_a_h_stock),
-            "f_stock_a": int(flight_stock_a),
-            "h_stock_b": int(curr_b_h_stock),
-            "f_stock_b": int(flight_stock_b),
-            "revenue_n_h": int(revenue_n_h),
-            "revenue_n_f": int(revenue_n_f),
-            "revenue_n": int(revenue_n_h + revenue_n_f),
-            "revenue_a": int(revenue_a_h + revenue_a_f),
-            "revenue_b": int(revenue_b_pkg + revenue_b_h_solo + revenue_b_f_solo),
-            "revenue_a_h": int(revenue_a_h),
-            "revenue_a_f": int(revenue_a_f),
-            "revenue_b_h": int(revenue_b_pkg_h_estimated + revenue_b_h_solo),
-            "revenue_b_f": int(revenue_b_pkg_f_estimated + revenue_b_f_solo),
-            "potential_waste_a": int(potential_waste_a),
-            "potential_waste_b": int(potential_waste_b),
-            "decay_factor": _get_decay_factor(t, lead_days)
-        })
+        potential_waste_a = (curr_a_h_stock * h_cost_unit) + (flight_stock_a * f_cost_unit)
+        potential_waste_b = (curr_b_h_stock * h_cost_unit) + (flight_stock_b * f_cost_unit)
+
+        # 当日時点の累計値を各列に記録
+        hist["day_idx"][i] = t
+        hist["profit_a"][i] = total_profit_a
+        hist["profit_b"][i] = total_profit_b
+        hist["h_stock_a"][i] = curr_a_h_stock
+        hist["f_stock_a"][i] = flight_stock_a
+        hist["h_stock_b"][i] = curr_b_h_stock
+        hist["f_stock_b"][i] = flight_stock_b
+        hist["revenue_n_h"][i] = revenue_n_h
+        hist["revenue_n_f"][i] = revenue_n_f
+        hist["revenue_a_h"][i] = revenue_a_h
+        hist["revenue_a_f"][i] = revenue_a_f
+        hist["revenue_b_pkg"][i] = revenue_b_pkg
+        hist["revenue_b_h_solo"][i] = revenue_b_h_solo
+        hist["revenue_b_f_solo"][i] = revenue_b_f_solo
+        hist["potential_waste_a"][i] = potential_waste_a
+        hist["potential_waste_b"][i] = potential_waste_b
 
     # 30日目の廃棄損 (Day 0)
     waste_a_h = curr_a_h_stock * h_item["cost"]
@@ -455,9 +582,18 @@ def simulate_sales_scenario(
     total_profit_b -= waste_b
     
     # 最終日の履歴を廃棄損考慮後に更新 (任意だが、グラフの末端を合わせるため)
-    if history:
-        history[-1]["profit_a"] = int(total_profit_a)
-        history[-1]["profit_b"] = int(total_profit_b)
+    if n_days:
+        hist["profit_a"][-1] = total_profit_a
+        hist["profit_b"][-1] = total_profit_b
+
+    # 派生列（合算売上・PKG按分）はループ後にまとめてベクトル演算で生成する。
+    # ※ シナリオBの売上内訳について、パッケージ売上は目安として 1:1 (半額ずつ) 按分として記録します。
+    pkg_h_estimated = np.floor_divide(hist["revenue_b_pkg"], 2)
+    hist["revenue_n"] = hist["revenue_n_h"] + hist["revenue_n_f"]
+    hist["revenue_a"] = hist["revenue_a_h"] + hist["revenue_a_f"]
+    hist["revenue_b"] = hist["revenue_b_pkg"] + hist["revenue_b_h_solo"] + hist["revenue_b_f_solo"]
+    hist["revenue_b_h"] = pkg_h_estimated + hist["revenue_b_h_solo"]
+    hist["revenue_b_f"] = (hist["revenue_b_pkg"] - pkg_h_estimated) + hist["revenue_b_f_solo"]
 
     return {
         "profit_a": int(total_profit_a),
@@ -465,7 +601,18 @@ def simulate_sales_scenario(
         "gain": int(total_profit_b - total_profit_a),
         "max_sets": int(h_item["remaining_stock"]), # 目安
         "packages_sold": int(total_sold_pkg),
-        "history": history,
+        # 最終日時点の在庫・販売数。ダッシュボード側での「逆算」を不要にする
+        "final_state": {
+            "h_stock_a": int(curr_a_h_stock),
+            "f_stock_a": int(flight_stock_a),
+            "h_stock_b": int(curr_b_h_stock),
+            "f_stock_b": int(flight_stock_b),
+            "sold_h_a": int(h_item["remaining_stock"] - curr_a_h_stock),
+            "sold_f_a": int(f_item["remaining_stock"] - flight_stock_a),
+            "sold_h_solo_b": int(sold_h_solo_b),
+            "sold_f_solo_b": int(sold_f_solo_b),
+        },
+        "history": hist,  # 列ごとの np.ndarray (SoA)
         "details_a": {
             "revenue": int(revenue_a_h + revenue_a_f),
             "cost": int(cost_a_h + cost_a_f),
@@ -29,6 +29,9 @@ import math
 from datetime import date, datetime, timezone
 from typing import Optional
 
+import numpy as np
+import pandas as pd
+
 from constants import (
     MAX_DISCOUNT_PCT, MAX_MARKUP_PCT, 
     BRAKE_THRESHOLD, BRAKE_STRENGTH_PCT
@@ -364,6 +367,212 @@ def calculate_pricing_result(
     }
 
 
+# ─────────────────────────────────────────
+# バッチ版: DataFrame を受け取り列演算で一括計算
+# ─────────────────────────────────────────
+
+def calculate_pricing_result_batch(
+    inv_df: pd.DataFrame,
+    config: Optional[dict] = None,
+    strategy: str = "rule_based",
+    reference_date: Optional[date] = None,
+) -> pd.DataFrame:
+    """全在庫の PricingResult を列演算で一括計算する。
+
+    calculate_pricing_result を N 回呼ぶ代わりに、在庫率・リードタイム・
+    各調整額・最終価格のクランプを ndarray 上の np.select / np.round で
+    まとめて計算する。JIT 依存（Numba 等）はあえて持たない: NumPy の
+    列演算だけならコンパイル待ちも実行環境の追加要件もなく、Streamlit の
+    rerun ごとのモジュール再実行とも相性が良い。販売速度（get_velocity_ratio）と需要予測
+    （calc_demand_based_pricing）は商品ごとの DB 参照を伴うため行単位の
+    まま残し、理由テキストと waterfall は計算済み配列から組み立てる。
+    出力の各行は calculate_pricing_result の返す辞書と同一キー・同一値。
+
+    Args:
+        inv_df:         inventory テーブル相当の DataFrame
+                        （id / name / base_price / total_stock /
+                          remaining_stock / departure_date / elasticity）
+        config:         AI Command Center の上下限・ブレーキ設定
+        strategy:       "rule_based" または "demand_based"
+        reference_date: 比較基準日（None なら今日）
+
+    Returns:
+        PricingResult を行とする DataFrame
+    """
+    today = reference_date or date.today()
+    n = len(inv_df)
+    if n == 0:
+        return pd.DataFrame()
+
+    ids   = inv_df["id"].to_numpy()
+    names = inv_df["name"].to_numpy()
+    bases = inv_df["base_price"].to_numpy(dtype=np.float64)
+    totals = inv_df["total_stock"].to_numpy(dtype=np.float64)
+    rems   = inv_df["remaining_stock"].to_numpy(dtype=np.float64)
+    deps = (
+        inv_df["departure_date"].to_numpy()
+        if "departure_date" in inv_df.columns else np.array([None] * n, dtype=object)
+    )
+    elas = (
+        inv_df["elasticity"].to_numpy(dtype=np.float64)
+        if "elasticity" in inv_df.columns else np.full(n, -1.5)
+    )
+
+    inv_ratio = np.where(totals > 0, rems / np.maximum(totals, 1.0), 0.0)
+
+    dep_parsed = pd.to_datetime(pd.Series(deps), errors="coerce")
+    lead_f = (dep_parsed - pd.Timestamp(today)).dt.days.to_numpy(dtype=np.float64)
+    has_dep = ~np.isnan(lead_f)
+
+    # ── 設定パラメータの取得 ───────────────────────────────────────
+    conf = config or {}
+    max_discount = conf.get("max_discount_pct", MAX_DISCOUNT_PCT * 100) / 100.0
+    max_markup   = conf.get("max_markup_pct", MAX_MARKUP_PCT * 100) / 100.0
+    brake_threshold = conf.get("brake_threshold", BRAKE_THRESHOLD)
+    brake_strength  = conf.get("brake_strength_pct", BRAKE_STRENGTH_PCT * 100) / 100.0
+
+    inv_adj  = np.zeros(n, dtype=np.int64)
+    time_adj = np.zeros(n, dtype=np.int64)
+    vel_adj  = np.zeros(n, dtype=np.int64)
+    demand_adj = np.zeros(n, dtype=np.int64)
+    decay_adj  = np.zeros(n, dtype=np.int64)
+    vr_list = [None] * n
+    brake = np.zeros(n, dtype=bool)
+    reasons: list[str] = []
+    waterfalls: list[list[dict]] = []
+
+    if strategy == "rule_based":
+        inv_adj = np.select(
+            [inv_ratio < 0.20, inv_ratio < 0.50, inv_ratio < 0.70],
+            [np.round(bases * 0.30), np.round(bases * 0.10), np.zeros(n)],
+            default=np.round(bases * -0.15),
+        ).astype(np.int64)
+        time_adj = np.select(
+            [~has_dep, lead_f < 0, lead_f <= 7, lead_f <= 30, lead_f <= 90],
+            [np.zeros(n), np.zeros(n), np.round(bases * -0.15),
+             np.round(bases * 0.10), np.zeros(n)],
+            default=np.round(bases * -0.10),
+        ).astype(np.int64)
+
+        for i in range(n):
+            ld = int(lead_f[i]) if has_dep[i] else None
+            try:
+                from packaging_engine import get_velocity_ratio
+                vr = get_velocity_ratio(int(ids[i]), int(totals[i]), int(rems[i]), ld, reference_date=reference_date)
+                vr_list[i] = vr
+                if vr and vr >= brake_threshold:
+                    vel_adj[i] = round(bases[i] * brake_strength)
+                    vel_reason = f"販売ペース異常({vr:.1f}x)を検知。自動ブレーキ発動(+¥{vel_adj[i]:,})"
+                    brake[i] = True
+                elif vr:
+                    vel_reason = f"販売ペースは正常({vr:.1f}x)です"
+                else:
+                    vel_reason = "販売速度データ不足"
+            except Exception:
+                vel_reason = "速度解析エラー"
+
+            ir_pct = int(inv_ratio[i] * 100)
+            if inv_ratio[i] < 0.20:
+                inv_reason = f"在庫残{ir_pct}%のため希少プレミアム(+¥{inv_adj[i]:,})"
+            elif inv_ratio[i] < 0.50:
+                inv_reason = f"在庫残{ir_pct}%のため需要増加調整(+¥{inv_adj[i]:,})"
+            elif inv_ratio[i] < 0.70:
+                inv_reason = f"在庫残{ir_pct}%のため標準価格（調整なし）"
+            else:
+                inv_reason = f"在庫残{ir_pct}%のため余裕割引(-¥{abs(inv_adj[i]):,})"
+
+            if ld is None:
+                time_reason = "出発日未設定のため時期調整なし"
+            elif ld < 0:
+                time_reason = "出発済み（価格計算対象外）"
+            elif ld <= 7:
+                time_reason = f"出発まで{ld}日のため直前割引(-¥{abs(time_adj[i]):,})"
+            elif ld <= 30:
+                time_reason = f"出発まで{ld}日のため需要ピーク調整(+¥{time_adj[i]:,})"
+            elif ld <= 90:
+                time_reason = f"出発まで{ld}日のため標準価格（調整なし）"
+            else:
+                time_reason = f"出発まで{ld}日のため早期予約割引(-¥{abs(time_adj[i]):,})"
+
+            reasons.append(f"{inv_reason}。{time_reason}。{vel_reason}。")
+            waterfalls.append([
+                {"label": "基本価格", "value": int(bases[i]), "measure": "absolute"},
+                {"label": "在庫調整", "value": int(inv_adj[i]),  "measure": "relative"},
+                {"label": "時期調整", "value": int(time_adj[i]), "measure": "relative"},
+                {"label": "速度調整", "value": int(vel_adj[i]),  "measure": "relative"},
+            ])
+
+        theoretical = bases + inv_adj + time_adj + vel_adj
+
+    elif strategy == "demand_based":
+        # 需要予測は商品ごとの販売履歴参照を伴うため行単位で計算する
+        for i in range(n):
+            ld = int(lead_f[i]) if has_dep[i] else None
+            try:
+                from packaging_engine import get_velocity_ratio
+                if ld:
+                    vr_list[i] = get_velocity_ratio(int(ids[i]), int(totals[i]), int(rems[i]), ld, reference_date=reference_date)
+            except Exception:
+                pass
+
+            if ld is not None:
+                d_adj, d_reason, _, _ = calc_demand_based_pricing(
+                    int(ids[i]), int(bases[i]), int(totals[i]), int(rems[i]), ld,
+                    elasticity=float(elas[i]), reference_date=reference_date,
+                )
+                demand_adj[i] = d_adj
+                decay = calculate_inventory_decay_factor(ld, 90, k=20.0, p=0.08)
+                target_price = int(bases[i]) + d_adj
+                decay_adj[i] = int(target_price * decay - target_price)
+                if decay < 0.95:
+                    reasons.append(f"{d_reason}。さらに出発直前のため見切り割引(-¥{abs(int(decay_adj[i])):,})が適用されています。")
+                else:
+                    reasons.append(d_reason)
+            else:
+                reasons.append("出発日未設定のため需要予測・減衰の対象外")
+
+            waterfalls.append([
+                {"label": "基本価格", "value": int(bases[i]),      "measure": "absolute"},
+                {"label": "需要予測", "value": int(demand_adj[i]), "measure": "relative"},
+                {"label": "期限減衰", "value": int(decay_adj[i]),  "measure": "relative"},
+            ])
+
+        theoretical = bases + demand_adj + decay_adj
+
+    else:
+        theoretical = bases.copy()
+        reasons = ["不明な戦略"] * n
+        waterfalls = [[] for _ in range(n)]
+
+    # ── 最終価格（上下限クランプ、100円単位への丸めまで一括）────────
+    final_price = np.round(theoretical / 100) * 100
+    min_p = np.round(bases * (1.0 - max_discount) / 100) * 100
+    max_p = np.round(bases * (1.0 + max_markup) / 100) * 100
+    final_price = np.clip(final_price, min_p, max_p).astype(np.int64)
+
+    for i in range(n):
+        waterfalls[i].append({"label": "最終価格", "value": int(final_price[i]), "measure": "total"})
+
+    return pd.DataFrame({
+        "inventory_id":         [int(x) for x in ids],
+        "name":                 list(names),
+        "base_price":           [int(x) for x in bases],
+        "inventory_adjustment": [int(x) for x in inv_adj],
+        "time_adjustment":      [int(x) for x in time_adj],
+        "velocity_adjustment":  [int(x) for x in vel_adj],
+        # None と float が混在するため object dtype を明示（NaN 化させない）
+        "velocity_ratio":       pd.Series(vr_list, dtype=object),
+        "final_price":          [int(x) for x in final_price],
+        "inv_ratio":            [round(float(x), 3) for x in inv_ratio],
+        "lead_days":            [int(lead_f[i]) if has_dep[i] else None for i in range(n)],
+        "departure_date":       list(deps),
+        "elasticity":           [float(x) for x in elas],
+        "reason":               reasons,
+        "waterfall":            waterfalls,
+        "is_brake_active":      [bool(b) for b in brake],
+    })
+
+
 # ─────────────────────────────────────────
 # DB から在庫を読み込んで一括計算
 # ─────────────────────────────────────────